@@ -1,25 +1,37 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, status
+from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, Header, Request, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
 from typing import Annotated
+from datetime import date
+import asyncio
 import models
-from database import Base, engine, SessionLocal
-from sqlalchemy.orm import Session
-from passlib.context import CryptContext
+import config
+import rollups
+import history
+import counters
+import renders
+import metrics
+import auth
+from database import Base, engine, async_engine, AsyncSessionLocal, db_stats, pool_status
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
 import json
 from datetime import datetime, timedelta
 
-import cv2
-from multiprocessing import Pool
 import os
 import uuid
-import cv2
-from ultralytics import YOLO
+from stat import S_ISREG
+from inference import registry, predict_uploads, init_worker
+from batching import InferenceBatcher
+from workers import WorkerPool, PoolSaturated
+from cache import PredictionCache
+from storage import get_storage
+from responses import etag_matches, file_response
+from uploads import UploadLimitMiddleware, receive_upload
  
 IMAGEDIR = "images/"
  
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 app = FastAPI()
 
@@ -27,6 +39,44 @@ models.Base.metadata.create_all(bind=engine)
 
 current_date = datetime.now().date()
 
+pool = WorkerPool(config.WORKER_POOL_KIND,
+    max_workers=config.WORKER_POOL_SIZE,
+    max_pending=config.WORKER_MAX_PENDING,
+    retry_after=config.WORKER_RETRY_AFTER,
+    initializer=init_worker,
+    initargs=(config.MODEL_WEIGHTS,))
+
+async def run_inference(uploads):
+    # workers get the weights and version currently served so process
+    # workers follow hot swaps, and never go back to older weights
+    served = registry.info()
+    outputs, stages = await pool.run(metrics.timed_call, predict_uploads, uploads, served['weights'], served['version'])
+    metrics.record_stages(stages)
+    return outputs
+
+storage = get_storage()
+
+render_cache = renders.RenderCache(config.RENDER_DIR, config.RENDER_CACHE_BYTES)
+
+# render misses get their own threads, so a busy inference pool never 503s image views
+render_pool = WorkerPool("thread", max_workers=config.RENDER_WORKERS, max_pending=config.RENDER_MAX_PENDING, retry_after=config.WORKER_RETRY_AFTER)
+
+prediction_cache = PredictionCache(config.CACHE_MAX_ENTRIES, config.CACHE_TTL_SECONDS, config.CACHE_PERSISTENT)
+
+# one batch in flight per process worker, or per warmed model copy in a thread pool
+batcher = InferenceBatcher(run_inference, max_batch_size=config.BATCH_MAX_SIZE, window_ms=config.BATCH_WINDOW_MS,
+    max_concurrency=pool.max_workers if pool.kind == "process" else min(pool.max_workers, registry.copies))
+
+achievement_buffer = counters.AchievementWriteBehind(AsyncSessionLocal, config.ACHIEVEMENT_FLUSH_MS) if config.ACHIEVEMENT_WRITE_BEHIND else None
+
+# read at scrape time, nothing to update on the request path
+metrics.Gauge("db_pool_connections", "Database pool connections by state.", ("state",),
+    callback=lambda: {(state,): value for state, value in pool_status().items() if state != "status"})
+metrics.Gauge("worker_pool_pending", "Images admitted to the worker pool.", callback=lambda: pool.stats()["pending"])
+metrics.Gauge("auth_pool_pending", "Password hashes waiting or running.", callback=lambda: auth.hash_pool.stats()["pending"])
+metrics.Gauge("render_pool_pending", "Image renders waiting or running.", callback=lambda: render_pool.stats()["pending"])
+metrics.Gauge("batcher_queue_depth", "Uploads waiting for the next inference batch.", callback=lambda: batcher.stats()["queue_depth"])
+
 class UserBase(BaseModel):
     username:str
     email:str
@@ -55,14 +105,21 @@ class ImageUpdate(BaseModel):
     name:str
     data:dict
 
-def get_db():
-    db = SessionLocal()
-    try:
+class ModelSwap(BaseModel):
+    weights:str
+
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
-db_dependency = Annotated[Session, Depends(get_db)]
+db_dependency = Annotated[AsyncSession, Depends(get_db)]
+
+# refuse oversized upload bodies before the multipart parser spools them;
+# added before CORS so the 413 still carries the CORS headers
+app.add_middleware(UploadLimitMiddleware, limits={
+    "/upload/": config.MAX_UPLOAD_BYTES + config.UPLOAD_FORM_OVERHEAD,
+    "/upload/batch/": (config.MAX_UPLOAD_BYTES + config.UPLOAD_FORM_OVERHEAD) * config.UPLOAD_BATCH_MAX_FILES,
+})
 
 app.add_middleware(
     CORSMiddleware,
@@ -72,15 +129,69 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# outermost, so rejected and failed requests are timed too
+app.add_middleware(metrics.MetricsMiddleware)
+
+@app.get("/metrics", include_in_schema=False)
+async def read_metrics():
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.exception_handler(PoolSaturated)
+async def pool_saturated_handler(request: Request, exc: PoolSaturated):
+    return JSONResponse(status_code=503, content={"detail": "Server busy, retry later"}, headers={"Retry-After": str(exc.retry_after)})
+
+@app.on_event("startup")
+async def load_model():
+    # load and warm up the weights before the first upload arrives
+    await asyncio.to_thread(registry.load)
+    await batcher.start()
+    if achievement_buffer is not None:
+        await achievement_buffer.start()
+
+@app.on_event("shutdown")
+async def stop_batcher():
+    await batcher.stop()
+    pool.shutdown()
+    render_pool.shutdown()
+    auth.hash_pool.shutdown()
+    if achievement_buffer is not None:
+        await achievement_buffer.stop()
+    await async_engine.dispose()
+
+def require_admin(x_admin_token: Annotated[str | None, Header()] = None):
+    if not config.ADMIN_TOKEN or x_admin_token != config.ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+@app.get("/admin/model/", dependencies=[Depends(require_admin)])
+async def model_info():
+    return registry.info()
+
+@app.post("/admin/model/", dependencies=[Depends(require_admin)])
+async def swap_model(swap:ModelSwap, db: db_dependency):
+    if not os.path.exists(swap.weights):
+        raise HTTPException(status_code=404, detail="Weights not found")
+    await asyncio.to_thread(registry.load, swap.weights)
+    await prediction_cache.invalidate(registry.info()['fingerprint'], db)
+    return registry.info()
+
+@app.get("/admin/inference/", dependencies=[Depends(require_admin)])
+async def inference_stats():
+    return {"batcher": batcher.stats(), "pool": pool.stats(), "cache": prediction_cache.stats(), "renders": render_cache.stats(), "render_pool": render_pool.stats()}
+
+@app.get("/admin/database/", dependencies=[Depends(require_admin)])
+async def database_stats():
+    return {"pool": pool_status(), **db_stats.snapshot()}
+
  
 @app.post("/register/")
 async def register_user(user:UserBase, db: db_dependency):
-    user.password = pwd_context.hash(user.password)  
+    # bcrypt on the auth thread pool, not the event loop
+    user.password = await auth.hash_password(user.password)
     db_user = models.User(**user.dict())
     db.add(db_user)
-    db.commit()
-    userQuery = db.query(models.User).filter(models.User.username == db_user.username).first()
-    db_achievement = models.Achievement(id=userQuery.id,
+    # flush assigns the id, so the user and their achievements commit together
+    await db.flush()
+    db_achievement = models.Achievement(id=db_user.id,
         plastic=0,
         paper=0,
         cardboard=0,
@@ -88,41 +199,148 @@ async def register_user(user:UserBase, db: db_dependency):
         glass=0,
         total=0)
     db.add(db_achievement)
-    db.commit()
+    await db.commit()
 
 
 @app.post("/login/")
 async def login_user(userlogin:UserLogin, db: db_dependency):
-    user = db.query(models.User).filter(models.User.username == userlogin.username).first()
-    if not user or not pwd_context.verify(userlogin.password, user.password ):
+    user = (await db.execute(select(models.User).filter(models.User.username == userlogin.username))).scalars().first()
+    if not user or not await auth.verify_password(userlogin.password, user.password):
         raise HTTPException(status_code=401, detail="Invalid username or password")
-    return {"message": "Login successful", "user_id": user.id, "username":user.username}
-
-@app.post("/upload/")
+    response = {"message": "Login successful", "user_id": user.id, "username":user.username}
+    if auth.tokens_enabled():
+        # later requests send the token instead of going through bcrypt again
+        response.update(token=auth.issue_token(user.id), token_type="bearer", expires_in=config.SESSION_TTL_SECONDS)
+    return response
+
+async def place_upload(db, upload):
+    # Stores a received upload under its content address and gives it a
+    # public name of its own. Re-uploads and client retries reuse the cached
+    # result and boxes; the returned (result, boxes) is None when the image
+    # still has to go through the model.
+    filename = f"{uuid.uuid4()}{upload.extension}"
+    storage_key = upload.key
+    await upload.store(storage)
+    model = registry.info()['fingerprint']
+    cache_key = prediction_cache.key(upload.digest, model)
+    cached = await prediction_cache.get(cache_key, db)
+    if cached is not None:
+        return filename, storage_key, cache_key, model, cached[1:]
+    return filename, storage_key, cache_key, model, None
+
+@app.post("/upload/", dependencies=[Depends(auth.check_session)])
 async def create_upload_file(user_id:int, db: db_dependency, file: UploadFile = File(...)):
  
-    file.filename = f"{uuid.uuid4()}.jpg"
-    contents = await file.read()
- 
-    #save the file
-    with open(f"{IMAGEDIR}{file.filename}", "wb") as f:
-        f.write(contents)
-    
-    result = prediction(IMAGEDIR+file.filename)
-    db_achievement = db.query(models.Achievement).filter(models.Achievement.id == user_id).first()
-    db_achievement.plastic += result['plastic']['q']
-    db_achievement.paper += result['paper']['q']
-    db_achievement.cardboard += result['cardboard']['q']
-    db_achievement.metal += result['metal']['q']
-    db_achievement.glass += result['glass']['q']
-    db_achievement.total = db_achievement.plastic + db_achievement.paper +db_achievement.cardboard +db_achievement.metal +db_achievement.glass
-
-    db_upload = models.Image(name = file.filename, user_id = user_id, result = json.dumps(result), date = current_date.strftime("%Y-%m-%d") )
-    db.add(db_upload)
-    db.commit()
+    # refuse with 503 up front when the workers are saturated
+    with pool.slot():
+        # streamed to disk in chunks; size, dimensions and type are checked on the way
+        with metrics.stage("upload_receive"):
+            upload = await receive_upload(file, IMAGEDIR)
+        try:
+            with metrics.stage("upload_store"):
+                file.filename, storage_key, cache_key, model, output = await place_upload(db, upload)
+        finally:
+            await upload.discard()
+        if output is None:
+            # decoded once in the worker straight from the stored upload; only
+            # the raw image is kept, the overlay is drawn by /get_image/
+            with metrics.stage("upload_predict"):
+                output = await batcher.submit(storage.local_path(storage_key))
+            if output is None:
+                await asyncio.to_thread(storage.delete, storage_key)
+                raise HTTPException(status_code=400, detail="Invalid image")
+            await prediction_cache.put(cache_key, model, storage_key, *output, db=db)
+    result, boxes = output
+    with metrics.stage("upload_commit"):
+        counts = counters.counts_from_result(result)
+        if achievement_buffer is None:
+            await db.execute(counters.increment_statement(user_id, counts))
+
+        db_upload = models.Image(name = file.filename, storage_key = storage_key, user_id = user_id, date = current_date, boxes = json.dumps(boxes) if boxes is not None else None, **models.Image.result_columns(result))
+        db.add(db_upload)
+        await rollups.apply_result(db, user_id, current_date, result)
+        await db.commit()
+        # buffered only once the upload is stored, so a failed commit is never counted
+        if achievement_buffer is not None:
+            achievement_buffer.add(user_id, counts)
 
     return {"filename": file.filename, "result":result}
- 
+
+async def stream_batch_upload(user_id, uploads, slots):
+    # NDJSON: one line per image as its chunk finishes, then a summary line
+    # once every Image/Achievement write is committed in one transaction
+    try:
+        async with AsyncSessionLocal() as db:
+            stored = []
+            for start in range(0, len(uploads), config.BATCH_MAX_SIZE):
+                results = []
+                misses = []
+                for index, upload in enumerate(uploads[start:start + config.BATCH_MAX_SIZE], start):
+                    filename, storage_key, cache_key, model, output = await place_upload(db, upload)
+                    results.append([index, filename, output, storage_key, cache_key, model])
+                    if output is None:
+                        misses.append(results[-1])
+                if misses:
+                    # one model call for every image in the chunk the cache could not answer
+                    outputs = await run_inference([storage.local_path(entry[3]) for entry in misses])
+                    for entry, output in zip(misses, outputs):
+                        entry[2] = output
+                        if output is None:
+                            await asyncio.to_thread(storage.delete, entry[3])
+                        else:
+                            await prediction_cache.put(entry[4], entry[5], entry[3], *output, db=db)
+                for index, filename, output, storage_key, _, _ in results:
+                    if output is None:
+                        yield json.dumps({"index": index, "error": "Invalid image"}) + "\n"
+                        continue
+                    stored.append((filename, storage_key, *output))
+                    yield json.dumps({"index": index, "filename": filename, "result": output[0]}) + "\n"
+
+            if stored:
+                totals = {category: {"q": 0, "w": 0} for category in models.CATEGORIES}
+                for _, _, result, _ in stored:
+                    for category in models.CATEGORIES:
+                        totals[category]["q"] += result[category]["q"]
+                        totals[category]["w"] += result[category]["w"]
+                await db.execute(insert(models.Image), [
+                    dict(name=filename, storage_key=storage_key, user_id=user_id, date=current_date, boxes=json.dumps(boxes) if boxes is not None else None, **models.Image.result_columns(result))
+                    for filename, storage_key, result, boxes in stored])
+                counts = counters.counts_from_result(totals)
+                if achievement_buffer is None:
+                    await db.execute(counters.increment_statement(user_id, counts))
+                await rollups.apply_result(db, user_id, current_date, totals)
+            await db.commit()
+            # buffered only once the batch is stored, so a failed commit is never counted
+            if stored and achievement_buffer is not None:
+                achievement_buffer.add(user_id, counts)
+            yield json.dumps({"done": True, "stored": len(stored), "failed": len(uploads) - len(stored)}) + "\n"
+    except Exception:
+        # headers are already sent, so report the failure in-band; nothing was committed
+        yield json.dumps({"done": False, "error": "Batch failed, nothing was stored"}) + "\n"
+        raise
+    finally:
+        for upload in uploads:
+            await upload.discard()
+        pool.release(slots)
+
+@app.post("/upload/batch/", dependencies=[Depends(auth.check_session)])
+async def create_upload_files(user_id:int, files: list[UploadFile] = File(...)):
+    if len(files) > config.UPLOAD_BATCH_MAX_FILES:
+        raise HTTPException(status_code=413, detail=f"At most {config.UPLOAD_BATCH_MAX_FILES} files per batch")
+    # one slot per image, held until the stream finishes
+    slots = pool.acquire(len(files))
+    uploads = []
+    try:
+        # stream every file to disk now; the form files do not outlive the handler
+        for file in files:
+            uploads.append(await receive_upload(file, IMAGEDIR))
+    except BaseException:
+        for upload in uploads:
+            await upload.discard()
+        pool.release(slots)
+        raise
+    return StreamingResponse(stream_batch_upload(user_id, uploads, slots), media_type="application/x-ndjson")
+
  
 # @app.get("/show/{image_id}")
 # async def read_image(image_id : str):
@@ -132,107 +350,124 @@ async def create_upload_file(user_id:int, db: db_dependency, file: UploadFile =
 #     return FileResponse(path)
 
 @app.get("/get_image/{image_request}")
-async def get_image(image_request: str):
-    image_path = os.path.join(IMAGEDIR, image_request)
-    if not os.path.exists(image_path):
+async def get_image(image_request: str, request: Request, db: db_dependency, variant: str = "annotated", size: str = "full"):
+    if variant not in renders.VARIANTS or size not in renders.SIZES:
+        raise HTTPException(status_code=422, detail="Unknown image variant or size")
+    row = (await db.execute(select(models.Image.storage_key, models.Image.boxes).filter(models.Image.name == image_request))).first()
+    if row is not None and row.storage_key:
+        source = storage.local_path(row.storage_key)
+        tag = os.path.splitext(row.storage_key)[0]
+    else:
+        # not yet moved by migrate_storage.py
+        source = os.path.join(IMAGEDIR, image_request)
+        tag = None
+    try:
+        stat = await asyncio.to_thread(os.stat, source)
+    except FileNotFoundError:
         raise HTTPException(status_code=404, detail="Image not found")
-    return FileResponse(image_path)
-
-
-@app.get("/show/{user_id}")
-async def read_image(user_id : int, db: db_dependency):
-    all_images = []
-    images = db.query(models.Image).filter(models.Image.user_id == user_id).all()
-    for i in images:
-        all_images.append(json.dumps({'name':i.name,'result':json.loads(i.result), 'date': i.date.strftime("%Y-%m-%d")}))
-    return all_images
+    # the storage shard directories live under IMAGEDIR too
+    if not S_ISREG(stat.st_mode):
+        raise HTTPException(status_code=404, detail="Image not found")
+    if tag is None:
+        tag = f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+    boxes = row.boxes if row is not None and variant == "annotated" else None
+    if boxes is None and size == "full":
+        # the raw upload, or an older upload stored with its overlay drawn on
+        return await file_response(request, source, f'"{tag}"', size=stat.st_size)
+    name = renders.render_name(tag, variant, size, boxes)
+    etag = f'"{os.path.splitext(name)[0]}"'
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return await file_response(request, source, etag, size=stat.st_size)
+    path = await asyncio.to_thread(render_cache.lookup, name)
+    if path is None:
+        # drawn on the render threads the first time this variant is requested
+        with render_pool.slot():
+            rendered, stages = await render_pool.run(metrics.timed_call, renders.render_image, source, render_cache.path(name), json.loads(boxes) if boxes else None, renders.SIZES[size])
+        metrics.record_stages(stages)
+        if not rendered:
+            raise HTTPException(status_code=500, detail="Could not render image")
+        path = await asyncio.to_thread(render_cache.add, name)
+    return await file_response(request, path, etag, media_type="image/jpeg")
+
+
+@app.get("/show/{user_id}", dependencies=[Depends(auth.check_session)])
+async def read_image(user_id : int):
+    # same payload as before, streamed instead of built up in memory
+    return StreamingResponse(history.stream_legacy(user_id), media_type="application/json")
+
+@app.get("/history/{user_id}", dependencies=[Depends(auth.check_session)])
+async def read_history(user_id : int, limit: int = 50, cursor: str | None = None, start: date | None = None, end: date | None = None):
+    if not 1 <= limit <= 500:
+        raise HTTPException(status_code=422, detail="limit must be between 1 and 500")
+    try:
+        position = history.decode_cursor(cursor) if cursor else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return StreamingResponse(history.stream_history(user_id, limit, start, end, position), media_type="application/x-ndjson")
 
     # path = f"{IMAGEDIR}{image_id}"
      
     # return FileResponse(path)
 
-@app.get("/show_achievement/{user_id}")
+@app.get("/show_achievement/{user_id}", dependencies=[Depends(auth.check_session)])
 async def read_achievement(user_id : int, db: db_dependency):
-    achievement = db.query(models.Achievement).filter(models.Achievement.id == user_id).first()
+    achievement = (await db.execute(select(models.Achievement).filter(models.Achievement.id == user_id))).scalars().first()
+    pending = achievement_buffer.pending(user_id) if achievement_buffer is not None else None
+    if achievement is not None and pending:
+        # include increments that have not been flushed yet
+        db.expunge(achievement)
+        for category, value in pending.items():
+            setattr(achievement, category, getattr(achievement, category) + value)
+        achievement.total += sum(pending.values())
     return achievement
 
 @app.post("/update/")
-async def update_data(data: ImageUpdate, db: db_dependency):
-    db_data = db.query(models.Image).filter(models.Image.name == data.name).first()
-    db_data.result = json.dumps(data.data)
-    db.commit()
-
-#MONTHLY QUANTITY
-@app.get("/show/monthlyquantity/{user_id}")
-async def show_monthly_quantity(user_id : int, db: db_dependency):
-    end_date = datetime.now()
-    start_date = end_date - timedelta(days=180)
-    all_images = []
-    months = []
+async def update_data(data: ImageUpdate, db: db_dependency, session_user: Annotated[int | None, Depends(auth.check_session)]):
+    db_data = (await db.execute(select(models.Image).filter(models.Image.name == data.name))).scalars().first()
+    if session_user is not None and db_data.user_id != session_user:
+        raise HTTPException(status_code=403, detail="Token does not belong to this user")
+    # move the rollups by the difference between the old and corrected result
+    await rollups.apply_correction(db, db_data.user_id, db_data.date, db_data.result_dict(), data.data)
+    for column, value in models.Image.result_columns(data.data).items():
+        setattr(db_data, column, value)
+    await db.commit()
+
+def build_chart(rows, label_format, value):
+    # rows are (date, category, quantity, weight) rollup rows, oldest first
+    labels = []
     chartData = [{'name': 'Cardboard', 'data' : []},
                 {'name': 'Paper', 'data' : []},
                 {'name': 'Plastic', 'data' : []},
                 {'name': 'Glass', 'data' : []},
                 {'name': 'Metal', 'data' : []}]
-    images = db.query(models.Image).filter(models.Image.user_id == user_id, models.Image.date.between(start_date, end_date)).all()
-    for image in images:
-        month = image.date.strftime("%B")
-        if month not in months:
-            months.append(month)
+    series = {data['name'].lower(): data['data'] for data in chartData}
+    for day, category, quantity, weight in rows:
+        label = day.strftime(label_format)
+        if label not in labels:
+            labels.append(label)
             for data in chartData:
                 data['data'].append(0)
-        result = json.loads(image.result)
-        monthIndex = months.index(month)
-        for i in chartData:
-            if i['name'] == 'Cardboard':
-                i['data'][monthIndex] += result['cardboard']['q']
-            elif i['name'] == 'Paper':
-                i['data'][monthIndex] += result['paper']['q']
-            elif i['name'] == 'Plastic':
-                i['data'][monthIndex] += result['plastic']['q']
-            elif i['name'] == 'Glass':
-                i['data'][monthIndex] += result['glass']['q']
-            elif i['name'] == 'Metal':
-                i['data'][monthIndex] += result['metal']['q']
-
-    return (json.dumps({'xAxis': months, 'data': chartData}))
+        series[category][labels.index(label)] += value(category, quantity, weight)
+    return (json.dumps({'xAxis': labels, 'data': chartData}))
+
+carbonEmission = {'cardboard': 1, 'paper': 0.4, 'plastic': 0.8, 'glass': 0.4, 'metal': 0.7}
+
+#MONTHLY QUANTITY
+@app.get("/show/monthlyquantity/{user_id}", dependencies=[Depends(auth.check_session)])
+async def show_monthly_quantity(user_id : int, db: db_dependency):
+    end_date = datetime.now()
+    start_date = end_date - timedelta(days=180)
+    rows = await rollups.chart_rows(db, user_id, start_date, end_date, monthly=True)
+    return build_chart(rows, "%B", lambda category, quantity, weight: quantity)
 
 
 #MONTHLY SAVED CARBON
-@app.get("/show/monthly/{user_id}")
+@app.get("/show/monthly/{user_id}", dependencies=[Depends(auth.check_session)])
 async def show_monthly(user_id : int, db: db_dependency):
     end_date = datetime.now()
     start_date = end_date - timedelta(days=180)
-    all_images = []
-    months = []
-    carbonEmission= {'Cardboard':1, 'Paper':0.4, 'Plastic': 0.8, 'Glass': 0.4, 'Metal':0.7}
-    chartData = [{'name': 'Cardboard', 'data' : []},
-                {'name': 'Paper', 'data' : []},
-                {'name': 'Plastic', 'data' : []},
-                {'name': 'Glass', 'data' : []},
-                {'name': 'Metal', 'data' : []}]
-    images = db.query(models.Image).filter(models.Image.user_id == user_id, models.Image.date.between(start_date, end_date)).all()
-    for image in images:
-        month = image.date.strftime("%B")
-        if month not in months:
-            months.append(month)
-            for data in chartData:
-                data['data'].append(0)
-        result = json.loads(image.result)
-        monthIndex = months.index(month)
-        for i in chartData:
-            if i['name'] == 'Cardboard':
-                i['data'][monthIndex] += ((result['cardboard']['w']/1000) * carbonEmission['Cardboard'])
-            elif i['name'] == 'Paper':
-                i['data'][monthIndex] += ((result['paper']['w']/1000) * carbonEmission['Paper'])
-            elif i['name'] == 'Plastic':
-                i['data'][monthIndex] += ((result['plastic']['w']/1000) * carbonEmission['Plastic'])
-            elif i['name'] == 'Glass':
-                i['data'][monthIndex] += ((result['glass']['w']/1000) * carbonEmission['Glass'])
-            elif i['name'] == 'Metal':
-                i['data'][monthIndex] += ((result['metal']['w']/1000) * carbonEmission['Metal'])
-
-    return (json.dumps({'xAxis': months, 'data': chartData}))
+    rows = await rollups.chart_rows(db, user_id, start_date, end_date, monthly=True)
+    return build_chart(rows, "%B", lambda category, quantity, weight: (weight/1000) * carbonEmission[category])
 
 
 
@@ -291,76 +526,21 @@ async def show_monthly(user_id : int, db: db_dependency):
 #     return (json.dumps({'xAxis': months, 'data': chartData + chartDataRecycle}))
 
 # DAILY QUANTITY
-@app.get("/show/dailyquantity/{user_id}")
+@app.get("/show/dailyquantity/{user_id}", dependencies=[Depends(auth.check_session)])
 async def show_daily_quantity(user_id : int, db: db_dependency):
     end_date = datetime.now()
     start_date = end_date - timedelta(days=7)
-    all_images = []
-    days = []
-    chartData = [{'name': 'Cardboard', 'data' : []},
-                {'name': 'Paper', 'data' : []},
-                {'name': 'Plastic', 'data' : []},
-                {'name': 'Glass', 'data' : []},
-                {'name': 'Metal', 'data' : []}]
-    images = db.query(models.Image).filter(models.Image.user_id == user_id, models.Image.date.between(start_date, end_date)).all()
-    for image in images:
-        day = image.date.strftime("%A")
-        if day not in days:
-            days.append(day)
-            for data in chartData:
-                data['data'].append(0)
-        result = json.loads(image.result)
-        dayIndex = days.index(day)
-        for i in chartData:
-            if i['name'] == 'Cardboard':
-                i['data'][dayIndex] += result['cardboard']['q']
-            elif i['name'] == 'Paper':
-                i['data'][dayIndex] += result['paper']['q']
-            elif i['name'] == 'Plastic':
-                i['data'][dayIndex] += result['plastic']['q']
-            elif i['name'] == 'Glass':
-                i['data'][dayIndex] += result['glass']['q']
-            elif i['name'] == 'Metal':
-                i['data'][dayIndex] += result['metal']['q']
-
-    return (json.dumps({'xAxis': days, 'data': chartData}))
+    rows = await rollups.chart_rows(db, user_id, start_date, end_date)
+    return build_chart(rows, "%A", lambda category, quantity, weight: quantity)
 
 
 # DAILY SAVED CARBON
-@app.get("/show/daily/{user_id}")
+@app.get("/show/daily/{user_id}", dependencies=[Depends(auth.check_session)])
 async def show_daily(user_id : int, db: db_dependency):
     end_date = datetime.now()
     start_date = end_date - timedelta(days=7)
-    all_images = []
-    days = []
-    carbonEmission= {'Cardboard':1, 'Paper':0.4, 'Plastic': 0.8, 'Glass': 0.4, 'Metal':0.7}
-    chartData = [{'name': 'Cardboard', 'data' : []},
-                {'name': 'Paper', 'data' : []},
-                {'name': 'Plastic', 'data' : []},
-                {'name': 'Glass', 'data' : []},
-                {'name': 'Metal', 'data' : []}]
-    images = db.query(models.Image).filter(models.Image.user_id == user_id, models.Image.date.between(start_date, end_date)).all()
-    for image in images:
-        day = image.date.strftime("%A")
-        if day not in days:
-            days.append(day)
-            for data in chartData:
-                data['data'].append(0)
-        result = json.loads(image.result)
-        dayIndex = days.index(day)
-        for i in chartData:
-            if i['name'] == 'Cardboard':
-                i['data'][dayIndex] += ((result['cardboard']['w']/1000) * carbonEmission['Cardboard'])
-            elif i['name'] == 'Paper':
-                i['data'][dayIndex] += ((result['paper']['w']/1000) * carbonEmission['Paper'])
-            elif i['name'] == 'Plastic':
-                i['data'][dayIndex] += ((result['plastic']['w']/1000) * carbonEmission['Plastic'])
-            elif i['name'] == 'Glass':
-                i['data'][dayIndex] += ((result['glass']['w']/1000) * carbonEmission['Glass'])
-            elif i['name'] == 'Metal':
-                i['data'][dayIndex] += ((result['metal']['w']/1000) * carbonEmission['Metal'])
-
-    return (json.dumps({'xAxis': days, 'data': chartData}))
+    rows = await rollups.chart_rows(db, user_id, start_date, end_date)
+    return build_chart(rows, "%A", lambda category, quantity, weight: (weight/1000) * carbonEmission[category])
 
 # DAILY COMPARISON CARBON
 # @app.get("/show/daily/{user_id}")
@@ -416,31 +596,3 @@ async def show_daily(user_id : int, db: db_dependency):
 #                 i['data'][dayIndex] += (result['metal'] * carbonEmissionRecycle['Metal'])
 
 #     return (json.dumps({'xAxis': days, 'data': chartData + chartDataRecycle}))
-
-def prediction(image_name):
-    result_dict = {'cardboard':{"q":0,"w":0}, 'paper': {"q":0,"w":0}, 'plastic': {"q":0,"w":0}, 'glass': {"q":0,"w":0}, 'metal': {"q":0,"w":0}}
-    model = YOLO('best.pt')
-    images = image_name
-    image = cv2.imread(images)
-    results = model.predict(images,imgsz=640,conf=0.5,iou=0.45)
-    results = results[0]
-    color = {0: (0, 102, 255), 1: (50, 205, 50), 2:(255, 92, 92), 3: (255, 255, 85), 4: (153, 50, 204)}  
-    border_thickness = 15  # Fixed thickness for rectangles and text
-    font_thickness = 10
-    font_scale = 4  # Fixed font scale for text
-    for i in range(len(results.boxes)):
-        box = results.boxes[i]
-        prob = round(box.conf[0].item(), 2)
-        class_id = box.cls[0].item()
-        name = results.names[class_id]
-        tensor = box.xyxy[0]
-        x1 = int(tensor[0].item())
-        y1 = int(tensor[1].item())
-        x2 = int(tensor[2].item())
-        y2 = int(tensor[3].item())
-        cv2.rectangle(image,(x1,y1),(x2,y2),color[class_id], thickness=border_thickness)
-        cv2.putText(image, name + " " + str(prob), (x1, y1-30), cv2.FONT_HERSHEY_SIMPLEX, font_scale, color[class_id], thickness=font_thickness)
-        result_dict[name]['q'] +=1
-        result_dict[name]['w'] += 100
-    cv2.imwrite(images, image)
-    return result_dict
@@ -0,0 +1,101 @@
+# Password hashing and session tokens.
+#
+# bcrypt is deliberately slow, so it runs on its own small thread pool
+# instead of the event loop; a burst of logins then queues there (and is
+# refused with 503 once AUTH_MAX_PENDING are waiting) while uploads and
+# dashboards keep being served. The bcrypt C code releases the GIL, so the
+# hashing threads really run in parallel.
+#
+# /login/ hands out an HMAC signed token, "<user_id>.<expiry>.<signature>",
+# that later requests send as "Authorization: Bearer <token>". Checking it is
+# one HMAC over a few bytes, no database and no bcrypt. Tokens are only
+# issued and checked once SESSION_SECRET is set: a per-process secret would
+# break them on every restart and between uvicorn workers.
+
+import base64
+import hashlib
+import hmac
+import logging
+import time
+from typing import Annotated
+
+from fastapi import Header, HTTPException, Request
+from passlib.context import CryptContext
+
+import config
+from workers import WorkerPool
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+hash_pool = WorkerPool("thread", max_workers=config.AUTH_HASH_WORKERS, max_pending=config.AUTH_MAX_PENDING, retry_after=config.WORKER_RETRY_AFTER)
+
+logger = logging.getLogger(__name__)
+
+SECRET = config.SESSION_SECRET.encode() or None
+
+if SECRET is None:
+    if config.SESSION_REQUIRED:
+        raise RuntimeError("SESSION_REQUIRED is set but SESSION_SECRET is not")
+    logger.warning("SESSION_SECRET is not set, session tokens are disabled")
+
+
+def tokens_enabled():
+    return SECRET is not None
+
+
+async def hash_password(password):
+    with hash_pool.slot():
+        return await hash_pool.run(pwd_context.hash, password)
+
+
+async def verify_password(password, hashed):
+    with hash_pool.slot():
+        return await hash_pool.run(pwd_context.verify, password, hashed)
+
+
+def _sign(payload):
+    digest = hmac.new(SECRET, payload.encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b"=").decode()
+
+
+def issue_token(user_id, ttl=None):
+    expires = int(time.time()) + (ttl or config.SESSION_TTL_SECONDS)
+    payload = f"{user_id}.{expires}"
+    return f"{payload}.{_sign(payload)}"
+
+
+def verify_token(token):
+    # user id for a valid, unexpired token, otherwise None
+    # the token comes straight from a header, so anything malformed is just
+    # an invalid token: only ASCII digits reach int(), and compare_digest gets
+    # bytes because it refuses str with non-ASCII characters
+    payload, _, signature = token.rpartition(".")
+    user_id, _, expires = payload.partition(".")
+    if not all(part.isascii() and part.isdecimal() for part in (user_id, expires)):
+        return None
+    if not hmac.compare_digest(signature.encode(), _sign(payload).encode()):
+        return None
+    if int(expires) < time.time():
+        return None
+    return int(user_id)
+
+
+def check_session(request: Request, authorization: Annotated[str | None, Header()] = None):
+    # Route dependency for per-user endpoints. A token, when sent, has to be
+    # valid and belong to the user_id in the path or query. Requests without
+    # one are let through unless SESSION_REQUIRED is on, so existing clients
+    # keep working until they send tokens.
+    if not tokens_enabled():
+        return None
+    if not authorization:
+        if config.SESSION_REQUIRED:
+            raise HTTPException(status_code=401, detail="Missing session token", headers={"WWW-Authenticate": "Bearer"})
+        return None
+    scheme, _, token = authorization.partition(" ")
+    user_id = verify_token(token.strip()) if scheme.lower() == "bearer" else None
+    if user_id is None:
+        raise HTTPException(status_code=401, detail="Invalid or expired session token", headers={"WWW-Authenticate": "Bearer"})
+    requested = request.path_params.get("user_id") or request.query_params.get("user_id")
+    if requested is not None and str(requested) != str(user_id):
+        raise HTTPException(status_code=403, detail="Token does not belong to this user")
+    return user_id
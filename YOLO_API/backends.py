@@ -0,0 +1,207 @@
+# Inference backends. Each one wraps a loaded model and turns a list of BGR
+# images into one Detections per image, in the coordinates of that image, so
+# everything after the model call is shared between them.
+#
+#   python backends.py export best.pt [--int8]
+
+import ast
+import os
+import queue
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+import config
+
+# xyxy is (n, 4) float, conf is (n,) float and cls is (n,) int
+Detections = namedtuple("Detections", ["xyxy", "conf", "cls"])
+
+# same limits as the ultralytics NMS, so both backends keep the same boxes
+MAX_NMS = 30000
+MAX_DET = 300
+MAX_WH = 7680
+
+
+def extract_detections(results):
+    # pull the boxes out as whole arrays once instead of indexing per box
+    boxes = results.boxes
+    return Detections(boxes.xyxy.cpu().numpy(), boxes.conf.cpu().numpy(), boxes.cls.cpu().numpy().astype(np.intp))
+
+
+class InferenceBackend:
+    # names maps class id -> class name; variant ends up in the model
+    # fingerprint, so cached predictions from another backend are not reused
+    names = None
+    variant = None
+
+    def predict(self, images):
+        raise NotImplementedError
+
+    def warmup(self, image, runs):
+        for _ in range(runs):
+            self.predict([image])
+
+
+class UltralyticsBackend(InferenceBackend):
+    variant = "ultralytics"
+
+    def __init__(self, weights, copies=1):
+        import torch
+        from ultralytics import YOLO
+        if config.INFERENCE_THREADS:
+            torch.set_num_threads(config.INFERENCE_THREADS)
+        # YOLO objects are not safe to share between threads, so thread
+        # workers get a fixed set of copies, all loaded (and warmed by the
+        # registry) up front; a batch checks one out and waits if none is free
+        self._copies = [YOLO(weights) for _ in range(copies)]
+        self._free = queue.SimpleQueue()
+        for model in self._copies:
+            self._free.put(model)
+        self.names = self._copies[0].names
+
+    def predict(self, images):
+        model = self._free.get()
+        try:
+            # one model call for the whole batch; ultralytics returns one Results per image
+            results = model.predict(images, imgsz=config.MODEL_IMGSZ, conf=config.MODEL_CONF, iou=config.MODEL_IOU, verbose=False)
+        finally:
+            self._free.put(model)
+        return [extract_detections(result) for result in results]
+
+    def warmup(self, image, runs):
+        for model in self._copies:
+            for _ in range(runs):
+                model.predict([image], imgsz=config.MODEL_IMGSZ, conf=config.MODEL_CONF, iou=config.MODEL_IOU, verbose=False)
+
+
+class OnnxBackend(InferenceBackend):
+    # Runs an exported graph with onnxruntime on the CPU. Pre- and
+    # post-processing follow ultralytics (letterbox to MODEL_IMGSZ, per-class
+    # NMS) so the counts match the PyTorch model.
+
+    def __init__(self, weights, copies=1):
+        # one session serves every thread, so copies is ignored
+        import onnxruntime as ort
+        path = onnx_path(weights)
+        if config.ONNX_INT8:
+            path = quantize(path)
+        self.variant = "onnx-int8" if config.ONNX_INT8 else "onnx"
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if config.INFERENCE_THREADS:
+            options.intra_op_num_threads = config.INFERENCE_THREADS
+        # batches are run image by image, so extra inter-op threads only contend
+        options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(path, sess_options=options, providers=["CPUExecutionProvider"])
+        self.input = self.session.get_inputs()[0]
+        self.names = ast.literal_eval(self.session.get_modelmeta().custom_metadata_map["names"])
+        size = self.input.shape[2]
+        self.imgsz = size if isinstance(size, int) else config.MODEL_IMGSZ
+
+    def predict(self, images):
+        detections = []
+        for image in images:
+            blob, gain, pad = letterbox(image, self.imgsz)
+            output = self.session.run(None, {self.input.name: blob})[0][0]
+            detections.append(postprocess(output, gain, pad, image.shape))
+        return detections
+
+
+def onnx_path(weights):
+    # .pt weights are exported once and the .onnx is kept next to them
+    if weights.endswith(".onnx"):
+        return weights
+    path = os.path.splitext(weights)[0] + ".onnx"
+    if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(weights):
+        from ultralytics import YOLO
+        YOLO(weights).export(format="onnx", imgsz=config.MODEL_IMGSZ, simplify=True)
+    return path
+
+
+def quantize(path):
+    # dynamic INT8 weights; activations stay float, so no calibration set is needed
+    target = os.path.splitext(path)[0] + ".int8.onnx"
+    if not os.path.exists(target) or os.path.getmtime(target) < os.path.getmtime(path):
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(path, target, weight_type=QuantType.QUInt8)
+    return target
+
+
+def letterbox(image, size):
+    # resize keeping the aspect ratio and pad to size x size with grey (114),
+    # exactly as ultralytics' LetterBox does for fixed-size exports
+    height, width = image.shape[:2]
+    gain = min(size / height, size / width)
+    new_w, new_h = round(width * gain), round(height * gain)
+    if (new_w, new_h) != (width, height):
+        image = cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    dw, dh = (size - new_w) / 2, (size - new_h) / 2
+    top, bottom = round(dh - 0.1), round(dh + 0.1)
+    left, right = round(dw - 0.1), round(dw + 0.1)
+    image = cv2.copyMakeBorder(image, top, bottom, left, right, cv2.BORDER_CONSTANT, value=(114, 114, 114))
+    blob = np.ascontiguousarray(image[:, :, ::-1].transpose(2, 0, 1)[None], dtype=np.float32) / 255.0
+    return blob, gain, (left, top)
+
+
+def nms(boxes, scores, iou):
+    # greedy NMS, highest score first, same rule as torchvision.ops.nms
+    x1, y1, x2, y2 = boxes.T
+    areas = (x2 - x1) * (y2 - y1)
+    order = scores.argsort()[::-1]
+    keep = []
+    while order.size:
+        i = order[0]
+        keep.append(i)
+        xx1 = np.maximum(x1[i], x1[order[1:]])
+        yy1 = np.maximum(y1[i], y1[order[1:]])
+        xx2 = np.minimum(x2[i], x2[order[1:]])
+        yy2 = np.minimum(y2[i], y2[order[1:]])
+        inter = np.clip(xx2 - xx1, 0, None) * np.clip(yy2 - yy1, 0, None)
+        overlap = inter / (areas[i] + areas[order[1:]] - inter)
+        order = order[1:][overlap <= iou]
+    return np.array(keep, dtype=np.intp)
+
+
+def postprocess(output, gain, pad, shape):
+    # output is (4 + classes, anchors): cx, cy, w, h then one score per class
+    scores = output[4:]
+    cls = scores.argmax(0)
+    conf = scores[cls, np.arange(scores.shape[1])]
+    mask = conf > config.MODEL_CONF
+    boxes, conf, cls = output[:4, mask].T, conf[mask], cls[mask]
+    order = conf.argsort()[::-1][:MAX_NMS]
+    boxes, conf, cls = boxes[order], conf[order], cls[order]
+    xyxy = np.empty_like(boxes)
+    xyxy[:, :2] = boxes[:, :2] - boxes[:, 2:] / 2
+    xyxy[:, 2:] = boxes[:, :2] + boxes[:, 2:] / 2
+    # offsetting by class keeps boxes of different classes from suppressing each other
+    keep = nms(xyxy + cls[:, None] * MAX_WH, conf, config.MODEL_IOU)[:MAX_DET]
+    xyxy, conf, cls = xyxy[keep], conf[keep], cls[keep]
+    xyxy -= np.array([pad[0], pad[1], pad[0], pad[1]], dtype=xyxy.dtype)
+    xyxy /= gain
+    height, width = shape[:2]
+    xyxy[:, [0, 2]] = xyxy[:, [0, 2]].clip(0, width)
+    xyxy[:, [1, 3]] = xyxy[:, [1, 3]].clip(0, height)
+    return Detections(xyxy, conf, cls.astype(np.intp))
+
+
+BACKENDS = {"ultralytics": UltralyticsBackend, "onnx": OnnxBackend}
+
+
+def load_backend(weights, kind=None, copies=1):
+    return BACKENDS[kind or config.INFERENCE_BACKEND](weights, copies)
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=["export"])
+    parser.add_argument("weights")
+    parser.add_argument("--int8", action="store_true")
+    args = parser.parse_args()
+
+    path = onnx_path(args.weights)
+    if args.int8:
+        path = quantize(path)
+    print(path)
\ No newline at end of file
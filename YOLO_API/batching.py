@@ -0,0 +1,125 @@
+import asyncio
+import time
+
+
+class InferenceBatcher:
+    # Collects single-image requests into micro-batches. A batch is flushed when
+    # it reaches max_batch_size or when the oldest request has waited
+    # window_ms, whichever comes first. Up to max_concurrency batches run at
+    # once, one per worker; while they do, the next batch keeps filling.
+
+    def __init__(self, run_batch, max_batch_size=8, window_ms=10, max_concurrency=1):
+        # run_batch is a coroutine function taking a list of items and
+        # returning one output per item
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.window = window_ms / 1000
+        self.max_concurrency = max_concurrency
+        self._queue = None
+        self._task = None
+        self._slots = None
+        self._running = set()
+        self._batches = 0
+        self._items = 0
+        self._last_batch_size = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    async def start(self):
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for task in list(self._running):
+            task.cancel()
+        await asyncio.gather(*self._running, return_exceptions=True)
+
+    async def submit(self, item):
+        await self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future, time.perf_counter()))
+        return await future
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.window
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            # wait for a free worker first, so a batch is never closed early
+            # only to sit behind the running ones
+            await self._slots.acquire()
+            try:
+                batch = await self._collect()
+            except BaseException:
+                self._slots.release()
+                raise
+            # callers that gave up (client disconnect) are dropped from the batch
+            batch = [entry for entry in batch if not entry[1].done()]
+            if not batch:
+                self._slots.release()
+                continue
+            started = time.perf_counter()
+            for _, _, enqueued in batch:
+                waited = started - enqueued
+                self._wait_total += waited
+                self._wait_max = max(self._wait_max, waited)
+            self._batches += 1
+            self._items += len(batch)
+            self._last_batch_size = len(batch)
+            task = asyncio.create_task(self._dispatch(batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _dispatch(self, batch):
+        try:
+            outputs = await self.run_batch([entry[0] for entry in batch])
+        except BaseException as exc:
+            for _, future, _ in batch:
+                if not future.done():
+                    if isinstance(exc, asyncio.CancelledError):
+                        future.cancel()
+                    else:
+                        future.set_exception(exc)
+            if not isinstance(exc, Exception):
+                raise
+            return
+        finally:
+            self._slots.release()
+        for (_, future, _), output in zip(batch, outputs):
+            if not future.done():
+                future.set_result(output)
+
+    def stats(self):
+        return {
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "running": len(self._running),
+            "max_concurrency": self.max_concurrency,
+            "max_batch_size": self.max_batch_size,
+            "window_ms": self.window * 1000,
+            "batches": self._batches,
+            "items": self._items,
+            "last_batch_size": self._last_batch_size,
+            "avg_batch_size": self._items / self._batches if self._batches else 0,
+            "avg_wait_ms": self._wait_total / self._items * 1000 if self._items else 0,
+            "max_wait_ms": self._wait_max * 1000,
+        }
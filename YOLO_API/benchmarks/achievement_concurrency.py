@@ -0,0 +1,109 @@
+# Fires concurrent /upload/ requests for one user through the running app and
+# checks that the Achievement row ends up exactly at the sum of the counts
+# the uploads returned, once with direct SQL increments and once with
+# write-behind. In write-behind mode the buffer flushes every few
+# milliseconds, so flushes keep running while uploads commit and buffer
+# their counts. A share of the uploads are not images and must not count,
+# and neither must uploads whose commit fails (on SQLite some hit "database
+# is locked" under this much concurrency; they are reported as failed).
+#
+#   python benchmarks/achievement_concurrency.py [--uploads 300] [--concurrency 64] [--invalid 0.1]
+#
+# Same offline setup as load_bench.py (stub model, throwaway SQLite). Each
+# mode runs in its own process, since the app reads ACHIEVEMENT_WRITE_BEHIND
+# at import.
+
+import argparse
+import os
+import subprocess
+import sys
+
+MODES = {"sql increments": "0", "write-behind": "1"}
+
+
+def run_mode(args):
+    import asyncio
+    import random
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    import httpx
+    from sqlalchemy import select
+
+    from load_bench import free_port, make_images, setup_users, start_server
+
+    import counters
+    import models
+    from database import SessionLocal
+
+    def read(user_id):
+        db = SessionLocal()
+        try:
+            achievement = db.execute(select(models.Achievement).filter(models.Achievement.id == user_id)).scalars().one()
+            return {column: getattr(achievement, column) for column in counters.ACHIEVEMENT_CATEGORIES + ["total"]}
+        finally:
+            db.close()
+
+    async def uploads(base_url):
+        images = make_images(8, "640x480")
+        rng = random.Random(0)
+        semaphore = asyncio.Semaphore(args.concurrency)
+        async with httpx.AsyncClient(base_url=base_url, timeout=120) as client:
+            user_id = (await setup_users(client, 1))[0]
+            before = read(user_id)
+
+            async def upload(index):
+                if rng.random() < args.invalid:
+                    data = b"not an image %d" % index
+                else:
+                    # trailing bytes after the JPEG end marker change the digest, not the picture
+                    data = rng.choice(images) + os.urandom(16)
+                async with semaphore:
+                    response = await client.post("/upload/", params={"user_id": user_id}, files={"file": (f"{index}.jpg", data, "image/jpeg")})
+                return response.status_code, response.json()["result"] if response.status_code == 200 else None
+
+            responses = await asyncio.gather(*(upload(i) for i in range(args.uploads)))
+        return user_id, before, responses
+
+    port = free_port()
+    server, thread = start_server(port)
+    try:
+        user_id, before, responses = asyncio.run(uploads(f"http://127.0.0.1:{port}"))
+    finally:
+        # shutdown stops the write-behind buffer, which flushes what is left
+        server.should_exit = True
+        thread.join()
+
+    stored = [result for status, result in responses if status == 200]
+    rejected = sum(400 <= status < 500 for status, _ in responses)
+    expected = {category: before[category] + sum(result[category]["q"] for result in stored) for category in counters.ACHIEVEMENT_CATEGORIES}
+    expected["total"] = before["total"] + sum(expected[category] - before[category] for category in counters.ACHIEVEMENT_CATEGORIES)
+    actual = read(user_id)
+    ok = expected == actual
+    print(f"{args.mode:>15}: {'ok' if ok else 'MISMATCH'} stored={len(stored)} rejected={rejected} failed={args.uploads - len(stored) - rejected} expected={expected} actual={actual}")
+    sys.exit(0 if ok else 1)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--uploads", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--invalid", type=float, default=0.1, help="share of uploads that are not images")
+    parser.add_argument("--flush-ms", type=int, default=5)
+    parser.add_argument("--mode", choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        return run_mode(args)
+
+    failed = False
+    for mode, write_behind in MODES.items():
+        env = {**os.environ, "ACHIEVEMENT_WRITE_BEHIND": write_behind, "ACHIEVEMENT_FLUSH_MS": str(args.flush_ms)}
+        command = [sys.executable, os.path.abspath(__file__), "--mode", mode, "--uploads", str(args.uploads),
+            "--concurrency", str(args.concurrency), "--invalid", str(args.invalid)]
+        failed |= subprocess.run(command, env=env).returncode != 0
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+# Images per second, and per core, for each inference backend and thread count.
+#
+#   python benchmarks/backend_bench.py images/ [--weights best.pt] [--threads 1,2,4] [--repeat 3]
+#
+# Every image goes through the full decode -> model -> summarize path the
+# workers run. Per-core throughput is images/s divided by the intra-op threads,
+# which is the number to compare when sizing a process pool.
+
+import argparse
+import glob
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+import config
+from backends import load_backend
+from inference import read_image, summarize
+
+VARIANTS = {"ultralytics": ("ultralytics", False), "onnx": ("onnx", False), "onnx-int8": ("onnx", True)}
+
+
+def run(backend, paths, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for path in paths:
+            image = read_image(path)
+            summarize(backend.predict([image])[0], backend.names)
+        best = min(best, time.perf_counter() - started)
+    return len(paths) / best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("images", help="directory of sample images")
+    parser.add_argument("--weights", default=config.MODEL_WEIGHTS)
+    parser.add_argument("--variants", default="ultralytics,onnx,onnx-int8")
+    parser.add_argument("--threads", default="1,2,4")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    paths = sorted(p for p in glob.glob(os.path.join(args.images, "*")) if read_image(p) is not None)
+    if not paths:
+        sys.exit("no readable images in " + args.images)
+
+    print(f"{len(paths)} images, imgsz {config.MODEL_IMGSZ}")
+    print(f"{'backend':>12} {'threads':>8} {'img/s':>8} {'img/s/core':>11}")
+    for variant in args.variants.split(","):
+        kind, config.ONNX_INT8 = VARIANTS[variant]
+        for threads in (int(t) for t in args.threads.split(",")):
+            config.INFERENCE_THREADS = threads
+            backend = load_backend(args.weights, kind)
+            # warm-up, so lazy allocations are not timed
+            backend.predict([np.zeros((config.MODEL_IMGSZ, config.MODEL_IMGSZ, 3), dtype=np.uint8)])
+            rate = run(backend, paths, args.repeat)
+            print(f"{variant:>12} {threads:>8} {rate:>8.2f} {rate / threads:>11.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+# Checks that the ONNX backend gives the same answers as the PyTorch model:
+# identical result_dict per image and every box matched to one of the same
+# class within the IoU / confidence tolerance. Exits non-zero on a mismatch.
+#
+#   python benchmarks/backend_parity.py images/ [--weights best.pt] [--int8]
+#
+# INT8 weights shift confidences a little, so expect to loosen --conf-tol
+# (and occasionally see a count change near MODEL_CONF) with --int8.
+
+import argparse
+import glob
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+import config
+from backends import load_backend
+from inference import read_image, summarize
+
+
+def box_iou(a, b):
+    lt = np.maximum(a[:, None, :2], b[None, :, :2])
+    rb = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    inter = np.prod(np.clip(rb - lt, 0, None), axis=2)
+    area_a = np.prod(a[:, 2:] - a[:, :2], axis=1)
+    area_b = np.prod(b[:, 2:] - b[:, :2], axis=1)
+    return inter / (area_a[:, None] + area_b[None, :] - inter)
+
+
+def compare(expected, actual, iou_tol, conf_tol):
+    # greedy one-to-one match of every reference box
+    if len(expected.cls) != len(actual.cls):
+        return f"{len(expected.cls)} boxes vs {len(actual.cls)}"
+    if not len(expected.cls):
+        return None
+    iou = box_iou(expected.xyxy, actual.xyxy)
+    iou[expected.cls[:, None] != actual.cls[None, :]] = 0
+    used = set()
+    for i in np.argsort(-expected.conf):
+        j = int(np.argmax(iou[i]))
+        if iou[i, j] < iou_tol or j in used:
+            return f"no match for box {expected.xyxy[i].round(1).tolist()} class {expected.cls[i]}"
+        if abs(float(expected.conf[i]) - float(actual.conf[j])) > conf_tol:
+            return f"confidence {expected.conf[i]:.3f} vs {actual.conf[j]:.3f}"
+        used.add(j)
+        iou[:, j] = 0
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("images", help="directory of sample images")
+    parser.add_argument("--weights", default=config.MODEL_WEIGHTS)
+    parser.add_argument("--int8", action="store_true")
+    parser.add_argument("--iou-tol", type=float, default=0.9)
+    parser.add_argument("--conf-tol", type=float, default=0.02)
+    args = parser.parse_args()
+
+    config.ONNX_INT8 = args.int8
+    reference = load_backend(args.weights, "ultralytics")
+    candidate = load_backend(args.weights, "onnx")
+    paths = sorted(p for p in glob.glob(os.path.join(args.images, "*")) if os.path.isfile(p))
+
+    failures = 0
+    for path in paths:
+        image = read_image(path)
+        if image is None:
+            continue
+        expected = reference.predict([image])[0]
+        actual = candidate.predict([image])[0]
+        problem = None
+        if summarize(expected, reference.names) != summarize(actual, candidate.names):
+            problem = "result_dict differs"
+        problem = problem or compare(expected, actual, args.iou_tol, args.conf_tol)
+        if problem:
+            failures += 1
+            print(f"FAIL {os.path.basename(path)}: {problem}")
+    print(f"{len(paths) - failures}/{len(paths)} images match ({candidate.variant})")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
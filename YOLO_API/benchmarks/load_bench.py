@@ -0,0 +1,344 @@
+# End-to-end load benchmark for the API. Starts `app` under uvicorn against
+# a throwaway SQLite database with a stub model, so it runs offline and the
+# numbers reflect the service rather than the network or the weights.
+#
+#   python benchmarks/load_bench.py [--duration 30] [--concurrency 16]
+#       [--mix upload=2,show=3,history=1,daily=2,monthly=2,achievement=1,login=1]
+#       [--model-ms 0] [--cache-hits 0.2] [--output run.json] [--compare base.json]
+#
+# Each of --concurrency clients runs a closed loop, picking a request from
+# --mix by weight. Throughput and p50/p95/p99 are reported per endpoint,
+# followed by microbenchmarks of predict_uploads() and the chart functions.
+# --output writes everything as JSON; --compare prints the change against an
+# earlier run. Needs uvicorn and httpx on top of the API's own dependencies.
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import socket
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import date, datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# everything the app touches lives in a scratch directory
+CWD = os.getcwd()
+WORKDIR = tempfile.mkdtemp(prefix="wasteai-bench-")
+os.chdir(WORKDIR)
+os.makedirs("images", exist_ok=True)
+open("stub.pt", "wb").write(b"stub weights")
+os.environ.update({
+    "DATABASE_URL": f"sqlite:///{WORKDIR}/bench.db",
+    "MODEL_WEIGHTS": "stub.pt",
+    "INFERENCE_BACKEND": "stub",
+    "WORKER_POOL_KIND": "thread",
+    "RENDER_DIR": f"{WORKDIR}/renders/",
+    "MODEL_WARMUP_RUNS": "0",
+    "SESSION_SECRET": "bench-secret",
+})
+
+import cv2
+import httpx
+import numpy as np
+import uvicorn
+
+import backends
+import models
+import rollups
+
+
+class StubBackend(backends.InferenceBackend):
+    # deterministic boxes from the pixels, plus an optional fixed model time
+    variant = "stub"
+    names = {0: 'cardboard', 1: 'glass', 2: 'metal', 3: 'paper', 4: 'plastic'}
+    delay = 0.0
+
+    def __init__(self, weights, copies=1):
+        pass
+
+    def predict(self, images):
+        if self.delay:
+            time.sleep(self.delay * len(images))
+        detections = []
+        for image in images:
+            height, width = image.shape[:2]
+            rng = np.random.default_rng(int(image[::97, ::97].sum()))
+            count = int(rng.integers(0, 6))
+            x1 = rng.uniform(0, width * 0.7, count)
+            y1 = rng.uniform(0, height * 0.7, count)
+            xyxy = np.stack([x1, y1, x1 + width * 0.2, y1 + height * 0.2], axis=1).reshape(-1, 4).astype(np.float32)
+            detections.append(backends.Detections(xyxy, rng.uniform(0.5, 1, count).astype(np.float32), rng.integers(0, 5, count).astype(np.intp)))
+        return detections
+
+
+backends.BACKENDS["stub"] = StubBackend
+
+import api
+from database import AsyncSessionLocal, SessionLocal, async_engine
+from inference import predict_uploads, registry
+
+PASSWORD = "bench-password"
+DASHBOARDS = {
+    "show": "/show/{user_id}",
+    "history": "/history/{user_id}",
+    "daily": "/show/daily/{user_id}",
+    "monthly": "/show/monthly/{user_id}",
+    "dailyquantity": "/show/dailyquantity/{user_id}",
+    "monthlyquantity": "/show/monthlyquantity/{user_id}",
+    "achievement": "/show_achievement/{user_id}",
+}
+
+
+def make_images(count, size):
+    # smooth gradients with a little noise, roughly phone-photo sized JPEGs
+    width, height = (int(v) for v in size.split("x"))
+    rng = np.random.default_rng(1)
+    images = []
+    for _ in range(count):
+        base = np.linspace(0, 255, width, dtype=np.float32)[None, :, None] * rng.uniform(0.3, 1, 3)
+        image = np.broadcast_to(base, (height, width, 3)) + rng.normal(0, 8, (height, width, 3))
+        ok, data = cv2.imencode(".jpg", np.clip(image, 0, 255).astype(np.uint8), [cv2.IMWRITE_JPEG_QUALITY, 85])
+        images.append(data.tobytes())
+    return images
+
+
+def seed_history(user_ids, per_user, days=180):
+    # past uploads and rollups, so dashboards have something to aggregate
+    rng = random.Random(2)
+    rows = []
+    for user_id in user_ids:
+        for _ in range(per_user):
+            result = {c: {"q": (q := rng.randint(0, 4)), "w": q * 100} for c in models.CATEGORIES}
+            rows.append(dict(name=f"{uuid.uuid4()}.jpg", user_id=user_id,
+                date=date.today() - timedelta(days=rng.randrange(days)), **models.Image.result_columns(result)))
+    db = SessionLocal()
+    try:
+        db.bulk_insert_mappings(models.Image, rows)
+        db.commit()
+        rollups.backfill(db)
+    finally:
+        db.close()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(port):
+    server = uvicorn.Server(uvicorn.Config(api.app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            sys.exit("server failed to start")
+        time.sleep(0.05)
+    return server, thread
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+def summarize_latencies(latencies, elapsed):
+    return {
+        "requests": len(latencies),
+        "rps": round(len(latencies) / elapsed, 2),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else None,
+        **{f"p{q}_ms": round(percentile(latencies, q) * 1000, 3) if latencies else None for q in (50, 95, 99)},
+    }
+
+
+async def setup_users(client, count):
+    user_ids = []
+    for i in range(count):
+        username = f"bench{i}"
+        await client.post("/register/", json={"username": username, "email": f"{username}@example.com", "password": PASSWORD})
+        response = await client.post("/login/", json={"username": username, "password": PASSWORD})
+        response.raise_for_status()
+        user_ids.append(response.json()["user_id"])
+    return user_ids
+
+
+async def one_request(client, kind, user_id, index, images, cache_hits):
+    if kind == "upload":
+        data = random.choice(images)
+        if random.random() >= cache_hits:
+            # trailing bytes after the JPEG end marker change the digest, not the picture
+            data += os.urandom(16)
+        return "/upload/", await client.post("/upload/", params={"user_id": user_id}, files={"file": ("bench.jpg", data, "image/jpeg")})
+    if kind == "login":
+        return "/login/", await client.post("/login/", json={"username": f"bench{index}", "password": PASSWORD})
+    route = DASHBOARDS[kind]
+    return route, await client.get(route.format(user_id=user_id))
+
+
+async def run_load(base_url, user_ids, images, args):
+    mix = [(kind, float(weight)) for kind, weight in (item.split("=") for item in args.mix.split(","))]
+    kinds, weights = zip(*mix)
+    latencies, errors = {}, {}
+    started = time.perf_counter()
+    measure_from = started + args.warmup
+    deadline = measure_from + args.duration
+
+    async def client_loop(client):
+        while time.perf_counter() < deadline:
+            kind = random.choices(kinds, weights)[0]
+            index = random.randrange(len(user_ids))
+            sent = time.perf_counter()
+            route, response = await one_request(client, kind, user_ids[index], index, images, args.cache_hits)
+            elapsed = time.perf_counter() - sent
+            if sent < measure_from:
+                continue
+            if response.status_code >= 400:
+                errors[route] = errors.get(route, 0) + 1
+            else:
+                latencies.setdefault(route, []).append(elapsed)
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=120, limits=limits) as client:
+        await asyncio.gather(*(client_loop(client) for _ in range(args.concurrency)))
+    measured = time.perf_counter() - measure_from
+    endpoints = {route: {**summarize_latencies(values, measured), "errors": errors.get(route, 0)} for route, values in sorted(latencies.items())}
+    for route, count in errors.items():
+        endpoints.setdefault(route, {**summarize_latencies([], measured), "errors": count})
+    total = summarize_latencies([v for values in latencies.values() for v in values], measured)
+    total["errors"] = sum(errors.values())
+    return endpoints, total
+
+
+def time_calls(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return {"n": repeat, "mean_ms": round(sum(timings) / repeat * 1000, 3),
+        "p50_ms": round(percentile(timings, 50) * 1000, 3), "p95_ms": round(percentile(timings, 95) * 1000, 3)}
+
+
+async def time_async(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        await fn()
+        timings.append(time.perf_counter() - started)
+    return {"n": repeat, "mean_ms": round(sum(timings) / repeat * 1000, 3),
+        "p50_ms": round(percentile(timings, 50) * 1000, 3), "p95_ms": round(percentile(timings, 95) * 1000, 3)}
+
+
+def run_micro(user_id, images, repeat):
+    registry.load()
+    path = os.path.join(WORKDIR, "micro.jpg")
+    with open(path, "wb") as f:
+        f.write(images[0])
+    results = {"predict_uploads": time_calls(lambda: predict_uploads([path]), repeat)}
+
+    async def charts():
+        end = datetime.now()
+        out = {}
+        async with AsyncSessionLocal() as db:
+            for name, days, monthly in (("daily", 7, False), ("monthly", 180, True)):
+                out[f"chart_rows.{name}"] = await time_async(lambda: rollups.chart_rows(db, user_id, end - timedelta(days=days), end, monthly=monthly), repeat)
+                rows = await rollups.chart_rows(db, user_id, end - timedelta(days=days), end, monthly=monthly)
+                label = "%B" if monthly else "%A"
+                out[f"build_chart.{name}"] = time_calls(lambda: api.build_chart(rows, label, lambda category, quantity, weight: (weight/1000) * api.carbonEmission[category]), repeat)
+        await async_engine.dispose()
+        return out
+
+    results.update(asyncio.run(charts()))
+    return results
+
+
+def compare(previous, current):
+    def change(old, new):
+        if old in (None, 0) or new is None:
+            return ""
+        return f"{(new - old) / old * 100:+.1f}%"
+
+    print(f"\nagainst {previous.get('started', '?')}")
+    print(f"{'endpoint':<32} {'rps':>18} {'p50 ms':>18} {'p95 ms':>18} {'p99 ms':>18}")
+    rows = {**current["endpoints"], "total": current["total"]}
+    before = {**previous.get("endpoints", {}), "total": previous.get("total", {})}
+    for route, stats in rows.items():
+        old = before.get(route, {})
+        cells = [f"{stats.get(key) or 0:>9} {change(old.get(key), stats.get(key)):>8}" for key in ("rps", "p50_ms", "p95_ms", "p99_ms")]
+        print(f"{route:<32} " + " ".join(cells))
+    for name, stats in current["micro"].items():
+        old = previous.get("micro", {}).get(name, {})
+        print(f"{name:<32} {'':>18} {stats['p50_ms']:>9} {change(old.get('p50_ms'), stats['p50_ms']):>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--duration", type=float, default=30, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=3, help="seconds excluded from the results")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--mix", default="upload=2,show=3,history=1,daily=2,monthly=2,achievement=1,login=1")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--history", type=int, default=300, help="seeded uploads per user")
+    parser.add_argument("--images", type=int, default=8)
+    parser.add_argument("--image-size", default="1280x960")
+    parser.add_argument("--model-ms", type=float, default=0, help="simulated model time per image")
+    parser.add_argument("--cache-hits", type=float, default=0.2, help="share of uploads repeating earlier content")
+    parser.add_argument("--micro-repeat", type=int, default=50)
+    parser.add_argument("--output")
+    parser.add_argument("--compare")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    StubBackend.delay = args.model_ms / 1000
+    images = make_images(args.images, args.image_size)
+    port = free_port()
+    server, thread = start_server(port)
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        async def prepare():
+            async with httpx.AsyncClient(base_url=base_url, timeout=120) as client:
+                return await setup_users(client, args.users)
+        user_ids = asyncio.run(prepare())
+        seed_history(user_ids, args.history)
+        endpoints, total = asyncio.run(run_load(base_url, user_ids, images, args))
+    finally:
+        server.should_exit = True
+        thread.join()
+
+    report = {
+        "started": datetime.now().isoformat(timespec="seconds"),
+        "config": vars(args),
+        "endpoints": endpoints,
+        "total": total,
+        "micro": run_micro(user_ids[0], images, args.micro_repeat),
+    }
+
+    print(f"{'endpoint':<32} {'reqs':>7} {'err':>5} {'rps':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for route, stats in {**endpoints, "total": total}.items():
+        print(f"{route:<32} {stats['requests']:>7} {stats['errors']:>5} {stats['rps']:>9} "
+            + " ".join(f"{stats[key] if stats[key] is not None else '-':>9}" for key in ("p50_ms", "p95_ms", "p99_ms")))
+    print()
+    for name, stats in report["micro"].items():
+        print(f"{name:<32} mean {stats['mean_ms']:>9} ms  p50 {stats['p50_ms']:>9} ms  p95 {stats['p95_ms']:>9} ms")
+
+    if args.output:
+        with open(os.path.join(CWD, args.output), "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(os.path.join(CWD, args.compare)) as f:
+            compare(json.load(f), report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+# Login throughput under concurrency, and what a login burst does to the
+# dashboards served next to it. Same offline setup as load_bench.py.
+#
+#   python benchmarks/login_bench.py [--duration 10] [--logins 16] [--dashboards 4]
+#
+# Phase one runs only dashboard requests; phase two adds --logins clients
+# hammering /login/. With bcrypt on the event loop the dashboard p95 in
+# phase two grows by roughly a hash per waiting login; on the auth thread pool it
+# should stay close to phase one. Dashboards send the session token from
+# /login/, so token checking is part of what is measured. Finally a token
+# check is timed against a bcrypt verify.
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import httpx
+
+from load_bench import CWD, PASSWORD, free_port, seed_history, setup_users, start_server, summarize_latencies
+
+import auth
+
+DASHBOARDS = ["/show/daily/{user_id}", "/show/monthly/{user_id}", "/show_achievement/{user_id}"]
+
+
+async def login(client, index):
+    response = await client.post("/login/", json={"username": f"bench{index}", "password": PASSWORD})
+    response.raise_for_status()
+    return response.json()
+
+
+async def run_phase(base_url, sessions, duration, logins, dashboards):
+    latencies = {"/login/": [], "dashboards": []}
+    errors = {"/login/": 0, "dashboards": 0}
+    deadline = time.perf_counter() + duration
+
+    async def login_loop(client):
+        while time.perf_counter() < deadline:
+            sent = time.perf_counter()
+            response = await client.post("/login/", json={"username": f"bench{random.randrange(len(sessions))}", "password": PASSWORD})
+            if response.status_code == 200:
+                latencies["/login/"].append(time.perf_counter() - sent)
+            else:
+                errors["/login/"] += 1
+
+    async def dashboard_loop(client):
+        while time.perf_counter() < deadline:
+            session = random.choice(sessions)
+            sent = time.perf_counter()
+            response = await client.get(random.choice(DASHBOARDS).format(user_id=session["user_id"]),
+                headers={"Authorization": f"Bearer {session['token']}"})
+            if response.status_code == 200:
+                latencies["dashboards"].append(time.perf_counter() - sent)
+            else:
+                errors["dashboards"] += 1
+
+    started = time.perf_counter()
+    async with httpx.AsyncClient(base_url=base_url, timeout=120) as client:
+        await asyncio.gather(*[login_loop(client) for _ in range(logins)], *[dashboard_loop(client) for _ in range(dashboards)])
+    elapsed = time.perf_counter() - started
+    return {name: {**summarize_latencies(values, elapsed), "errors": errors[name]} for name, values in latencies.items() if values or errors[name]}
+
+
+def time_checks(token, hashed, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        auth.verify_token(token)
+    token_us = (time.perf_counter() - started) / repeat * 1e6
+    started = time.perf_counter()
+    for _ in range(max(1, repeat // 1000)):
+        auth.pwd_context.verify(PASSWORD, hashed)
+    bcrypt_us = (time.perf_counter() - started) / max(1, repeat // 1000) * 1e6
+    return {"verify_token_us": round(token_us, 2), "bcrypt_verify_us": round(bcrypt_us, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--duration", type=float, default=10, help="seconds per phase")
+    parser.add_argument("--logins", type=int, default=16, help="concurrent login clients")
+    parser.add_argument("--dashboards", type=int, default=4, help="concurrent dashboard clients")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--history", type=int, default=100)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    port = free_port()
+    server, thread = start_server(port)
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        async def prepare():
+            async with httpx.AsyncClient(base_url=base_url, timeout=120) as client:
+                user_ids = await setup_users(client, args.users)
+                return user_ids, [await login(client, i) for i in range(len(user_ids))]
+        user_ids, sessions = asyncio.run(prepare())
+        seed_history(user_ids, args.history)
+        baseline = asyncio.run(run_phase(base_url, sessions, args.duration, 0, args.dashboards))
+        burst = asyncio.run(run_phase(base_url, sessions, args.duration, args.logins, args.dashboards))
+    finally:
+        server.should_exit = True
+        thread.join()
+
+    hashed = auth.pwd_context.hash(PASSWORD)
+    report = {"config": vars(args), "dashboards_only": baseline, "with_logins": burst, "checks": time_checks(sessions[0]["token"], hashed, 10000)}
+
+    print(f"{'phase':<16} {'endpoint':<12} {'reqs':>7} {'err':>5} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for phase in ("dashboards_only", "with_logins"):
+        for name, stats in report[phase].items():
+            print(f"{phase:<16} {name:<12} {stats['requests']:>7} {stats['errors']:>5} {stats['rps']:>8} "
+                + " ".join(f"{stats[key] if stats[key] is not None else '-':>9}" for key in ("p50_ms", "p95_ms", "p99_ms")))
+    print(f"\ntoken check {report['checks']['verify_token_us']} us, bcrypt verify {report['checks']['bcrypt_verify_us']} us")
+
+    if args.output:
+        with open(os.path.join(CWD, args.output), "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+# Per-image post-processing time as the number of detections grows.
+#
+#   python benchmarks/postprocess_bench.py [--repeat 50] [--counts 0,10,50,100,200]
+#
+# Compares the old per-box .item() loop against the array based
+# extract_detections/summarize/draw_detections path, with and without drawing.
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cv2
+import numpy as np
+import torch
+from ultralytics.engine.results import Results
+
+from backends import extract_detections
+from inference import CLASS_COLORS, draw_detections, summarize
+
+NAMES = {0: 'cardboard', 1: 'glass', 2: 'metal', 3: 'paper', 4: 'plastic'}
+
+
+def fake_results(image, count, rng):
+    height, width = image.shape[:2]
+    x1 = rng.uniform(0, width * 0.8, count)
+    y1 = rng.uniform(0, height * 0.8, count)
+    x2 = x1 + rng.uniform(10, width * 0.2, count)
+    y2 = y1 + rng.uniform(10, height * 0.2, count)
+    conf = rng.uniform(0.5, 1.0, count)
+    cls = rng.integers(0, len(NAMES), count)
+    boxes = torch.tensor(np.stack([x1, y1, x2, y2, conf, cls], axis=1), dtype=torch.float32).reshape(-1, 6)
+    return Results(image, path="bench.jpg", names=NAMES, boxes=boxes)
+
+
+def legacy(image, results):
+    result_dict = {'cardboard':{"q":0,"w":0}, 'paper': {"q":0,"w":0}, 'plastic': {"q":0,"w":0}, 'glass': {"q":0,"w":0}, 'metal': {"q":0,"w":0}}
+    for i in range(len(results.boxes)):
+        box = results.boxes[i]
+        prob = round(box.conf[0].item(), 2)
+        class_id = box.cls[0].item()
+        name = results.names[class_id]
+        tensor = box.xyxy[0]
+        x1 = int(tensor[0].item())
+        y1 = int(tensor[1].item())
+        x2 = int(tensor[2].item())
+        y2 = int(tensor[3].item())
+        cv2.rectangle(image,(x1,y1),(x2,y2),CLASS_COLORS[class_id], thickness=15)
+        cv2.putText(image, name + " " + str(prob), (x1, y1-30), cv2.FONT_HERSHEY_SIMPLEX, 4, CLASS_COLORS[class_id], thickness=10)
+        result_dict[name]['q'] +=1
+        result_dict[name]['w'] += 100
+    return result_dict
+
+
+def vectorized(image, results, draw):
+    detections = extract_detections(results)
+    result_dict = summarize(detections, results.names)
+    if draw:
+        draw_detections(image, detections, results.names)
+    return result_dict
+
+
+def timeit(fn, image, results, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        canvas = image.copy()
+        started = time.perf_counter()
+        fn(canvas, results)
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--counts", default="0,1,10,50,100,200")
+    parser.add_argument("--size", default="3024x4032", help="image WIDTHxHEIGHT")
+    args = parser.parse_args()
+
+    width, height = (int(v) for v in args.size.split("x"))
+    image = np.zeros((height, width, 3), dtype=np.uint8)
+    rng = np.random.default_rng(0)
+
+    print(f"{'boxes':>6} {'legacy ms':>10} {'vector ms':>10} {'no-draw ms':>11}")
+    for count in (int(c) for c in args.counts.split(",")):
+        results = fake_results(image, count, rng)
+        assert legacy(image.copy(), results) == vectorized(image.copy(), results, draw=False)
+        old = timeit(legacy, image, results, args.repeat)
+        new = timeit(lambda img, res: vectorized(img, res, True), image, results, args.repeat)
+        bare = timeit(lambda img, res: vectorized(img, res, False), image, results, args.repeat)
+        print(f"{count:>6} {old:>10.3f} {new:>10.3f} {bare:>11.3f}")
+
+
+if __name__ == "__main__":
+    main()
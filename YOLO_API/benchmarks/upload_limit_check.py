@@ -0,0 +1,80 @@
+# Checks that UploadLimitMiddleware answers 413 for oversized uploads, both
+# with a Content-Length header and for chunked bodies that only cross the
+# limit part way through, and lets uploads under the limit through. Drives
+# the ASGI app directly, so no server or database is needed.
+#
+#   python benchmarks/upload_limit_check.py
+
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi import FastAPI, File, UploadFile
+
+from uploads import UploadLimitMiddleware
+
+LIMIT = 64 * 1024
+BOUNDARY = b"limitcheck"
+
+app = FastAPI()
+app.add_middleware(UploadLimitMiddleware, limits={"/upload/": LIMIT})
+
+
+@app.post("/upload/")
+async def upload(file: UploadFile = File(...)):
+    return {"size": len(await file.read())}
+
+
+def multipart(size):
+    return (b"--" + BOUNDARY + b"\r\n"
+        b'Content-Disposition: form-data; name="file"; filename="a.jpg"\r\n'
+        b"Content-Type: image/jpeg\r\n\r\n" + b"x" * size + b"\r\n"
+        b"--" + BOUNDARY + b"--\r\n")
+
+
+async def post(body, chunked, chunk_size=8192):
+    headers = [(b"content-type", b"multipart/form-data; boundary=" + BOUNDARY)]
+    if chunked:
+        headers.append((b"transfer-encoding", b"chunked"))
+    else:
+        headers.append((b"content-length", str(len(body)).encode()))
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": "/upload/", "raw_path": b"/upload/", "root_path": "", "query_string": b"",
+        "headers": headers, "client": ("127.0.0.1", 1), "server": ("127.0.0.1", 80)}
+    chunks = [body[i:i + chunk_size] for i in range(0, len(body), chunk_size)]
+    sent = []
+
+    async def receive():
+        if chunks:
+            return {"type": "http.request", "body": chunks.pop(0), "more_body": bool(chunks)}
+        await asyncio.sleep(3600)
+
+    async def send(message):
+        sent.append(message)
+
+    await app(scope, receive, send)
+    starts = [m for m in sent if m["type"] == "http.response.start"]
+    assert len(starts) == 1, f"expected one response, got {len(starts)}"
+    return starts[0]["status"]
+
+
+async def main():
+    cases = [
+        ("under the limit, content-length", multipart(LIMIT // 2), False, 200),
+        ("under the limit, chunked", multipart(LIMIT // 2), True, 200),
+        ("over the limit, content-length", multipart(LIMIT * 2), False, 413),
+        ("over the limit, chunked", multipart(LIMIT * 2), True, 413),
+    ]
+    failed = 0
+    for name, body, chunked, expected in cases:
+        status = await asyncio.wait_for(post(body, chunked), 10)
+        ok = status == expected
+        failed += not ok
+        print(f"{'ok  ' if ok else 'FAIL'} {name}: {status} (expected {expected})")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,106 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, update
+from sqlalchemy.exc import IntegrityError
+
+import config
+import models
+
+
+class PredictionCache:
+    # Two tier cache of upload results. The in-memory tier is an LRU bounded by
+    # entry count and TTL; the optional persistent tier lives in the
+    # prediction_cache table so hits survive restarts and are shared between
+    # workers. Entries are keyed on the model fingerprint, so new weights
+    # never see results from the old ones.
+
+    def __init__(self, max_entries=1024, ttl=3600, persistent=False):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.persistent = persistent
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._counts = {"memory_hits": 0, "db_hits": 0, "misses": 0, "evictions": 0}
+
+    def key(self, digest, model):
+        raw = f"{digest}:{model}:{config.MODEL_IMGSZ}:{config.MODEL_CONF}:{config.MODEL_IOU}"
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def _get_memory(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry["expires"] < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def _put_memory(self, key, name, result, boxes):
+        with self._lock:
+            self._entries[key] = {"name": name, "result": result, "boxes": boxes, "expires": time.monotonic() + self.ttl}
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._counts["evictions"] += 1
+
+    async def get(self, key, db=None):
+        entry = self._get_memory(key)
+        if entry is not None:
+            self._counts["memory_hits"] += 1
+            return entry["name"], entry["result"], entry["boxes"]
+        if self.persistent and db is not None:
+            row = await db.get(models.PredictionCache, key)
+            if row is not None and row.created_at >= datetime.now() - timedelta(seconds=self.ttl):
+                result = json.loads(row.result)
+                boxes = json.loads(row.boxes) if row.boxes else None
+                self._put_memory(key, row.name, result, boxes)
+                self._counts["db_hits"] += 1
+                return row.name, result, boxes
+        self._counts["misses"] += 1
+        return None
+
+    async def put(self, key, model, name, result, boxes=None, db=None):
+        # the persistent row is committed together with the upload it belongs
+        # to, so writing it must never fail that upload
+        self._put_memory(key, name, result, boxes)
+        if self.persistent and db is not None:
+            table = models.PredictionCache
+            values = dict(model=model, name=name, result=json.dumps(result),
+                boxes=json.dumps(boxes) if boxes is not None else None, created_at=datetime.now())
+            if (await db.execute(update(table).where(table.key == key).values(**values))).rowcount:
+                return
+            try:
+                async with db.begin_nested():
+                    db.add(table(key=key, **values))
+            except IntegrityError:
+                # a concurrent upload of the same bytes stored the entry first
+                pass
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    async def invalidate(self, model=None, db=None):
+        # drop everything produced by weights other than `model`
+        with self._lock:
+            self._entries.clear()
+        if self.persistent and db is not None:
+            query = delete(models.PredictionCache)
+            if model is not None:
+                query = query.where(models.PredictionCache.model != model)
+            await db.execute(query)
+            await db.commit()
+
+    def stats(self):
+        with self._lock:
+            size = len(self._entries)
+        hits = self._counts["memory_hits"] + self._counts["db_hits"]
+        lookups = hits + self._counts["misses"]
+        return dict(self._counts, size=size, max_entries=self.max_entries, hit_ratio=hits / lookups if lookups else 0)
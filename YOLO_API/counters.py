@@ -0,0 +1,77 @@
+# Achievement counters. Increments are applied in SQL
+# (`SET plastic = plastic + :n`), so concurrent uploads for the same user
+# never lose updates and never wait on a row lock held across inference.
+# With write-behind enabled, increments are merged in memory per user and
+# flushed every ACHIEVEMENT_FLUSH_MS, one UPDATE per user per flush.
+
+import asyncio
+import logging
+
+from sqlalchemy import update
+
+import models
+
+ACHIEVEMENT_CATEGORIES = ['plastic', 'paper', 'cardboard', 'metal', 'glass']
+
+logger = logging.getLogger(__name__)
+
+
+def counts_from_result(result):
+    return {category: result[category]['q'] for category in ACHIEVEMENT_CATEGORIES}
+
+
+def increment_statement(user_id, counts):
+    achievement = models.Achievement
+    values = {category: getattr(achievement, category) + counts.get(category, 0) for category in ACHIEVEMENT_CATEGORIES}
+    values['total'] = achievement.total + sum(counts.values())
+    return update(achievement).where(achievement.id == user_id).values(**values)
+
+
+class AchievementWriteBehind:
+
+    def __init__(self, session_factory, flush_ms=200):
+        self.session_factory = session_factory
+        self.flush_interval = flush_ms / 1000
+        self._pending = {}
+        self._task = None
+
+    def add(self, user_id, counts):
+        totals = self._pending.setdefault(user_id, dict.fromkeys(ACHIEVEMENT_CATEGORIES, 0))
+        for category, value in counts.items():
+            totals[category] += value
+
+    def pending(self, user_id):
+        return self._pending.get(user_id)
+
+    async def flush(self):
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        try:
+            async with self.session_factory() as db:
+                for user_id, counts in batch.items():
+                    await db.execute(increment_statement(user_id, counts))
+                await db.commit()
+        except Exception:
+            logger.exception("achievement flush failed, keeping %d users for the next flush", len(batch))
+            for user_id, counts in batch.items():
+                self.add(user_id, counts)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
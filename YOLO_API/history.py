@@ -0,0 +1,77 @@
+# Upload history queries. Rows are read in batches with only the columns the
+# response needs and are serialized as they arrive, so a user with years of
+# uploads never has their whole history in memory.
+
+import base64
+import json
+from datetime import date
+
+from sqlalchemy import and_, or_, select
+
+import models
+from database import AsyncSessionLocal
+
+HISTORY_COLUMNS = [models.Image.id, models.Image.name, models.Image.date] + [
+    getattr(models.Image, category + suffix) for category in models.CATEGORIES for suffix in ('_q', '_w')]
+
+
+def encode_cursor(day, image_id):
+    return base64.urlsafe_b64encode(f"{day.isoformat()}|{image_id}".encode()).decode()
+
+
+def decode_cursor(cursor):
+    # raises ValueError for anything that is not a cursor we handed out
+    day, image_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+    return date.fromisoformat(day), int(image_id)
+
+
+def row_item(row):
+    result = {category: {"q": getattr(row, category + '_q'), "w": getattr(row, category + '_w')} for category in models.CATEGORIES}
+    return {'name': row.name, 'result': result, 'date': row.date.strftime("%Y-%m-%d")}
+
+
+def history_query(user_id, start=None, end=None, cursor=None):
+    # newest first; the keyset condition continues right after the cursor row
+    # and is served by the (user_id, date) index
+    image = models.Image
+    query = select(*HISTORY_COLUMNS).filter(image.user_id == user_id)
+    if start is not None:
+        query = query.filter(image.date >= start)
+    if end is not None:
+        query = query.filter(image.date <= end)
+    if cursor is not None:
+        day, image_id = cursor
+        query = query.filter(or_(image.date < day, and_(image.date == day, image.id < image_id)))
+    return query.order_by(image.date.desc(), image.id.desc())
+
+
+async def stream_history(user_id, limit, start=None, end=None, cursor=None, batch_size=200):
+    # NDJSON: one line per upload, then a final {"next_cursor": ...} line
+    # (null once there are no more pages). Uses its own session because it
+    # outlives the request's dependencies.
+    async with AsyncSessionLocal() as db:
+        query = history_query(user_id, start, end, cursor).limit(limit + 1).execution_options(yield_per=batch_size)
+        last = None
+        count = 0
+        more = False
+        async for row in await db.stream(query):
+            if count == limit:
+                more = True
+                break
+            yield json.dumps(row_item(row)) + "\n"
+            last = row
+            count += 1
+        next_cursor = encode_cursor(last.date, last.id) if more else None
+        yield json.dumps({'next_cursor': next_cursor}) + "\n"
+
+
+async def stream_legacy(user_id, batch_size=200):
+    # the original /show/{user_id} payload: a JSON array of JSON strings
+    async with AsyncSessionLocal() as db:
+        query = select(*HISTORY_COLUMNS).filter(models.Image.user_id == user_id).order_by(models.Image.id)
+        yield "["
+        first = True
+        async for row in await db.stream(query.execution_options(yield_per=batch_size)):
+            yield ("" if first else ",") + json.dumps(json.dumps(row_item(row)))
+            first = False
+        yield "]"
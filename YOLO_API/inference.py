@@ -0,0 +1,180 @@
+import hashlib
+import threading
+import time
+
+import cv2
+import numpy as np
+
+import config
+from backends import Detections, load_backend
+from imaging import decode_image
+from metrics import stage
+
+# grams credited per detected item
+WEIGHT_PER_ITEM = 100
+
+CLASS_COLORS = {0: (0, 102, 255), 1: (50, 205, 50), 2:(255, 92, 92), 3: (255, 255, 85), 4: (153, 50, 204)}
+
+class ModelRegistry:
+    # Process-wide holder for the inference backend (see backends.py). The
+    # weights are loaded once and swapped atomically: a request grabs the
+    # current (model, version) pair and keeps using it even if a swap happens
+    # while it is running. copies is how many models the backend loads for
+    # concurrent batches; every copy is warmed before the swap.
+
+    def __init__(self, copies=1):
+        self.copies = copies
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._model = None
+        self._weights = None
+        self._version = 0
+        self._fingerprint = None
+        self._loaded_at = None
+        # version of the parent registry the current model mirrors; in the
+        # parent (and thread workers sharing it) that is simply _version
+        self._source = 0
+
+    def _load(self, weights):
+        model = load_backend(weights, copies=self.copies)
+        model.warmup(np.zeros((config.MODEL_IMGSZ, config.MODEL_IMGSZ, 3), dtype=np.uint8), config.MODEL_WARMUP_RUNS)
+        return model
+
+    def _swap(self, model, weights, source=None):
+        fingerprint = file_digest(weights)
+        if model.variant != "ultralytics":
+            # another runtime may differ in the last decimal of a box, keep its cache apart
+            fingerprint = hashlib.sha256(f"{fingerprint}:{model.variant}".encode()).hexdigest()
+        with self._lock:
+            self._model = model
+            self._weights = weights
+            self._fingerprint = fingerprint
+            self._version += 1
+            self._source = source if source is not None else self._version
+            self._loaded_at = time.time()
+            return self._model, self._version
+
+    def _current(self, version):
+        with self._lock:
+            if self._model is not None and (version is None or version <= self._source):
+                return self._model, self._version
+        return None
+
+    def load(self, weights=None):
+        weights = weights or config.MODEL_WEIGHTS
+        # only the reference swap takes the lock, so in-flight requests keep
+        # running on the old model while the new one loads and warms up
+        with self._load_lock:
+            return self._swap(self._load(weights), weights)[1]
+
+    def get(self, weights=None, version=None):
+        # Worker processes keep their own registry; callers pass the weights
+        # and version the parent is serving, so a hot swap reaches them on
+        # their next batch. Only a newer version loads anything: a batch sent
+        # before a swap never reloads the old weights over the new ones, which
+        # matters for thread workers sharing the parent's registry.
+        current = self._current(version)
+        if current is not None:
+            return current
+        with self._load_lock:
+            current = self._current(version)
+            if current is not None:
+                return current
+            weights = weights or config.MODEL_WEIGHTS
+            return self._swap(self._load(weights), weights, version)
+
+    def info(self):
+        with self._lock:
+            return {"weights": self._weights, "backend": self._model.variant if self._model else None, "fingerprint": self._fingerprint, "version": self._version, "loaded_at": self._loaded_at}
+
+
+def file_digest(path):
+    # content hash of the weights, so caches survive restarts but not new weights
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# process workers each keep their own registry with a single copy
+registry = ModelRegistry(config.MODEL_COPIES if config.WORKER_POOL_KIND == "thread" else 1)
+
+
+def init_worker(weights=None):
+    registry.load(weights)
+
+
+def predict_batch(images, weights=None, version=None):
+    # one Detections per image, from whichever backend is configured
+    with stage("model_load"):
+        model, _ = registry.get(weights, version)
+    with stage("inference"):
+        return model.predict(images), model.names
+
+
+def summarize(detections, names):
+    result_dict = {'cardboard':{"q":0,"w":0}, 'paper': {"q":0,"w":0}, 'plastic': {"q":0,"w":0}, 'glass': {"q":0,"w":0}, 'metal': {"q":0,"w":0}}
+    counts = np.bincount(detections.cls, minlength=len(names))
+    for class_id in np.flatnonzero(counts):
+        quantity = int(counts[class_id])
+        result_dict[names[class_id]]['q'] = quantity
+        result_dict[names[class_id]]['w'] = quantity * WEIGHT_PER_ITEM
+    return result_dict
+
+
+def draw_detections(image, detections, names, scale=1.0):
+    # scale shrinks the strokes and labels for downsized renders
+    border_thickness = max(1, round(15 * scale))  # Fixed thickness for rectangles and text
+    font_thickness = max(1, round(10 * scale))
+    font_scale = 4 * scale  # Fixed font scale for text
+    label_offset = round(30 * scale)
+    coords = detections.xyxy.astype(int).tolist()
+    for (x1, y1, x2, y2), prob, class_id in zip(coords, detections.conf.tolist(), detections.cls.tolist()):
+        cv2.rectangle(image,(x1,y1),(x2,y2),CLASS_COLORS[class_id], thickness=border_thickness)
+        cv2.putText(image, names[class_id] + " " + str(round(prob, 2)), (x1, y1-label_offset), cv2.FONT_HERSHEY_SIMPLEX, font_scale, CLASS_COLORS[class_id], thickness=font_thickness)
+    return image
+
+
+def serialize_detections(detections, names, shape):
+    # boxes are stored relative to the image size so any render size, and
+    # reduced-resolution decodes, map back onto the stored file
+    height, width = shape[:2]
+    xyxy = np.round(detections.xyxy / np.array([width, height, width, height], dtype=np.float32), 5).tolist()
+    boxes = [[*box, round(prob, 4), class_id] for box, prob, class_id in zip(xyxy, detections.conf.tolist(), detections.cls.tolist())]
+    return {"names": [names[i] for i in range(len(names))], "boxes": boxes}
+
+
+def deserialize_detections(data, shape):
+    height, width = shape[:2]
+    boxes = np.array(data["boxes"], dtype=np.float32).reshape(-1, 6)
+    xyxy = boxes[:, :4] * np.array([width, height, width, height], dtype=np.float32)
+    return Detections(xyxy, boxes[:, 4], boxes[:, 5].astype(np.intp)), data["names"]
+
+
+def process_result(image, detections, names):
+    # only counts and boxes; the overlay is drawn later, if anyone asks for it
+    return summarize(detections, names), serialize_detections(detections, names, image.shape)
+
+
+def read_image(image_name):
+    with stage("read"):
+        with open(image_name, "rb") as f:
+            data = f.read()
+    with stage("decode"):
+        return decode_image(data)
+
+
+def predict_uploads(image_names, weights=None, version=None):
+    # Each stored upload is read and decoded once in the worker and the array
+    # goes straight to the model. Returns (result_dict, boxes) per image, or
+    # None for uploads that could not be decoded.
+    images = [read_image(name) for name in image_names]
+    valid = [i for i, image in enumerate(images) if image is not None]
+    outputs = [None] * len(image_names)
+    if valid:
+        detections, names = predict_batch([images[i] for i in valid], weights, version)
+        with stage("postprocess"):
+            for i, found in zip(valid, detections):
+                outputs[i] = process_result(images[i], found, names)
+    return outputs
@@ -0,0 +1,254 @@
+# In-process counters, gauges and histograms, rendered in the Prometheus text
+# format at /metrics. Recording is a lock, a bisect and two additions, a
+# microsecond or so, so it can stay on for every request.
+#
+# Code that runs in the worker pool times its stages with `stage(...)` under
+# `timed_call`, which hands the timings back with the result; the parent
+# records them, so process workers report into the same histograms.
+
+import asyncio
+import bisect
+import logging
+import os
+import random
+import threading
+import time
+
+import config
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# seconds; from sub-millisecond stages up to a slow upload
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+logger = logging.getLogger(__name__)
+
+REGISTRY = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        REGISTRY.append(self)
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, labels, value) for labels, value in self._values.items()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{_labels(self.labelnames, labels)} {value}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    # either set directly, or read from callback() at scrape time; the
+    # callback returns a number, or {labels: value} for labelled gauges
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def set(self, value, labels=()):
+        with self._lock:
+            self._values[labels] = value
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, labels=(), amount=1):
+        self.inc(labels, -amount)
+
+    def samples(self):
+        if self.callback is None:
+            return super().samples()
+        try:
+            value = self.callback()
+        except Exception:
+            logger.exception("gauge %s callback failed", self.name)
+            return []
+        if not isinstance(value, dict):
+            value = {(): value}
+        return [(self.name, labels, v) for labels, v in value.items() if v is not None]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, labels=()):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                # per-bucket counts (last one is +Inf), then sum
+                series = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def samples(self):
+        with self._lock:
+            snapshot = [(labels, list(series)) for labels, series in self._values.items()]
+        samples = []
+        for labels, series in snapshot:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series[:-1]):
+                cumulative += count
+                samples.append((self.name + "_bucket", labels + (bound,), cumulative))
+            samples.append((self.name + "_sum", labels, series[-1]))
+            samples.append((self.name + "_count", labels, cumulative))
+        return samples
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for name, labels, value in self.samples():
+            names = self.labelnames + ("le",) if name.endswith("_bucket") else self.labelnames
+            lines.append(f"{name}{_labels(names, labels)} {value}")
+        return "\n".join(lines)
+
+
+def render():
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+
+
+REQUESTS = Counter("http_requests_total", "HTTP requests by route and status.", ("method", "route", "status"))
+REQUEST_SECONDS = Histogram("http_request_duration_seconds", "HTTP request latency by route.", ("method", "route"))
+IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP requests being handled.")
+SLOW_REQUESTS = Counter("http_slow_requests_total", "Requests slower than PROFILE_SLOW_MS.", ("route",))
+STAGE_SECONDS = Histogram("stage_duration_seconds", "Time spent in each upload, inference and render stage.", ("stage",))
+
+
+# stage timing
+
+_local = threading.local()
+
+
+class stage:
+    # with stage("decode"): ...  records the wall time of the block
+    __slots__ = ("name", "started")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.started
+        pending = getattr(_local, "stages", None)
+        if pending is not None:
+            pending.append((self.name, elapsed))
+        else:
+            STAGE_SECONDS.observe(elapsed, (self.name,))
+
+
+def timed_call(fn, *args):
+    # runs in a worker; returns (result, [(stage, seconds), ...])
+    _local.stages = stages = []
+    try:
+        return fn(*args), stages
+    finally:
+        _local.stages = None
+
+
+def record_stages(stages):
+    for name, elapsed in stages:
+        STAGE_SECONDS.observe(elapsed, (name,))
+
+
+# request middleware
+
+class MetricsMiddleware:
+    # Counts and times every HTTP request under its route template (so
+    # /show/{user_id} is one series, not one per user). With PROFILE_SLOW_MS
+    # set and pyinstrument installed, a sample of requests also runs under
+    # the sampling profiler and the report is kept when the request turns
+    # out to be slow.
+
+    def __init__(self, app):
+        self.app = app
+        self.slow = config.PROFILE_SLOW_MS / 1000
+        self.profiler = None
+        self.profiling = False
+        if self.slow and config.PROFILE_SAMPLE_RATE > 0:
+            try:
+                from pyinstrument import Profiler
+                self.profiler = Profiler
+            except ImportError:
+                logger.warning("PROFILE_SLOW_MS is set but pyinstrument is not installed; slow requests are only counted")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = 500
+
+        async def status_send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        profiler = None
+        if self.profiler is not None and not self.profiling and random.random() < config.PROFILE_SAMPLE_RATE:
+            # pyinstrument allows one profiler per thread, so one request at a time
+            self.profiling = True
+            profiler = self.profiler(async_mode="enabled")
+            profiler.start()
+
+        IN_FLIGHT.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, status_send)
+        finally:
+            elapsed = time.perf_counter() - started
+            IN_FLIGHT.dec()
+            route = scope.get("route")
+            route = route.path if route is not None else "unmatched"
+            REQUESTS.inc((scope["method"], route, status))
+            REQUEST_SECONDS.observe(elapsed, (scope["method"], route))
+            if self.slow and elapsed >= self.slow:
+                SLOW_REQUESTS.inc((route,))
+            if profiler is not None:
+                profiler.stop()
+                self.profiling = False
+                if elapsed >= self.slow:
+                    await asyncio.to_thread(save_profile, profiler, route, elapsed)
+
+
+def save_profile(profiler, route, elapsed):
+    os.makedirs(config.PROFILE_DIR, exist_ok=True)
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-{route.strip('/').replace('/', '_').replace('{', '').replace('}', '') or 'root'}-{round(elapsed * 1000)}ms.html"
+    with open(os.path.join(config.PROFILE_DIR, name), "w") as f:
+        f.write(profiler.output_html())
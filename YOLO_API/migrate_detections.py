@@ -0,0 +1,71 @@
+# Moves the per-class detections of existing `posts` rows out of the JSON
+# `result` string into the numeric columns, adds the `boxes` columns and the
+# (user_id, date) and name indexes. Safe to re-run: converted rows have `result` cleared (where the
+# column can be made nullable), so a later
+# /update/ correction is never overwritten by the old JSON.
+#
+#   python migrate_detections.py [--batch-size 1000]
+
+import argparse
+import json
+
+from sqlalchemy import inspect, text
+
+import models
+from database import SessionLocal, engine
+
+
+def add_columns():
+    inspector = inspect(engine)
+    existing = {column['name']: column for column in inspector.get_columns('posts')}
+    with engine.begin() as conn:
+        for category in models.CATEGORIES:
+            for suffix in ('_q', '_w'):
+                if category + suffix not in existing:
+                    conn.execute(text(f"ALTER TABLE posts ADD COLUMN {category}{suffix} INTEGER NOT NULL DEFAULT 0"))
+        if 'boxes' not in existing:
+            conn.execute(text("ALTER TABLE posts ADD COLUMN boxes TEXT NULL"))
+        if inspector.has_table('prediction_cache') and 'boxes' not in {c['name'] for c in inspector.get_columns('prediction_cache')}:
+            conn.execute(text("ALTER TABLE prediction_cache ADD COLUMN boxes TEXT NULL"))
+        if not existing['result']['nullable'] and engine.dialect.name == 'mysql':
+            conn.execute(text("ALTER TABLE posts MODIFY result VARCHAR(255) NULL"))
+    indexes = {index['name'] for index in inspect(engine).get_indexes('posts')}
+    for index in models.Image.__table__.indexes:
+        if index.name not in indexes:
+            index.create(bind=engine)
+
+
+def convert_rows(batch_size):
+    nullable = {column['name']: column['nullable'] for column in inspect(engine).get_columns('posts')}['result']
+    db = SessionLocal()
+    converted = 0
+    last_id = 0
+    try:
+        while True:
+            rows = db.query(models.Image.id, models.Image.result).filter(
+                models.Image.id > last_id, models.Image.result.isnot(None)
+            ).order_by(models.Image.id).limit(batch_size).all()
+            if not rows:
+                break
+            mappings = []
+            for row_id, result in rows:
+                mapping = {'id': row_id, **models.Image.result_columns(json.loads(result))}
+                if nullable:
+                    mapping['result'] = None
+                mappings.append(mapping)
+            db.bulk_update_mappings(models.Image, mappings)
+            db.commit()
+            converted += len(rows)
+            last_id = rows[-1][0]
+    finally:
+        db.close()
+    return converted
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    add_columns()
+    print(f"converted {convert_rows(args.batch_size)} rows")
@@ -0,0 +1,89 @@
+# Moves uploads from the old flat images/<name> layout into content-addressed
+# storage and records each row's storage_key. Files uploaded more than once
+# (cache hits used to hard link them) collapse into a single stored copy.
+# Safe to re-run: rows that already have a key are skipped, and rows whose
+# file is missing are reported and left alone.
+#
+#   python migrate_storage.py [--batch-size 500] [--image-dir images/]
+
+import argparse
+import hashlib
+import os
+import shutil
+
+from sqlalchemy import inspect, text
+
+import models
+from database import SessionLocal, engine
+from imaging import EXTENSIONS, sniff_type
+from storage import get_storage
+
+
+def add_column():
+    existing = {column['name'] for column in inspect(engine).get_columns('posts')}
+    if 'storage_key' not in existing:
+        with engine.begin() as conn:
+            conn.execute(text("ALTER TABLE posts ADD COLUMN storage_key VARCHAR(80) NULL"))
+
+
+def content_key(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        head = f.read(64)
+        digest.update(head)
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    extension = EXTENSIONS.get(sniff_type(head)) or os.path.splitext(path)[1].lower()
+    return digest.hexdigest() + extension
+
+
+def move_rows(image_dir, batch_size):
+    storage = get_storage()
+    db = SessionLocal()
+    moved = missing = 0
+    done = []
+    last_id = 0
+    try:
+        while True:
+            rows = db.query(models.Image.id, models.Image.name).filter(
+                models.Image.id > last_id, models.Image.storage_key.is_(None)
+            ).order_by(models.Image.id).limit(batch_size).all()
+            if not rows:
+                break
+            mappings = []
+            for row_id, name in rows:
+                path = os.path.join(image_dir, name)
+                if not os.path.isfile(path):
+                    missing += 1
+                    continue
+                key = content_key(path)
+                # store a link so the flat file survives until the row is committed
+                staged = path + '.migrating'
+                try:
+                    os.link(path, staged)
+                except OSError:
+                    shutil.copyfile(path, staged)
+                storage.put(staged, key)
+                mappings.append({'id': row_id, 'storage_key': key})
+                done.append(path)
+            db.bulk_update_mappings(models.Image, mappings)
+            db.commit()
+            for path in done:
+                os.remove(path)
+            done.clear()
+            moved += len(mappings)
+            last_id = rows[-1][0]
+    finally:
+        db.close()
+    return moved, missing
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--image-dir", default="images/")
+    args = parser.parse_args()
+
+    add_column()
+    moved, missing = move_rows(args.image_dir, args.batch_size)
+    print(f"moved {moved} images, {missing} rows without a file")
\ No newline at end of file
@@ -1,4 +1,4 @@
-from sqlalchemy import Boolean, Column, Integer, String, Date
+from sqlalchemy import Boolean, Column, Integer, String, Date, DateTime, Text, Index
 from database import Base
 
 class User(Base):
@@ -9,14 +9,46 @@ class User(Base):
     email = Column(String(255), unique=True, nullable=False)
     password = Column(String(255), nullable=False)
 
+CATEGORIES = ['cardboard', 'paper', 'plastic', 'glass', 'metal']
+
 class Image(Base):
     __tablename__ = 'posts'
+    __table_args__ = (Index('ix_posts_user_id_date', 'user_id', 'date'),)
 
     id = Column(Integer, primary_key=True, index=True)
-    name = Column(String(255), nullable=False)
+    name = Column(String(255), nullable=False, index=True)
+    # content address of the stored file; NULL for files still in the old flat layout
+    storage_key = Column(String(80), nullable=True)
     user_id = Column(Integer, nullable=False)
-    result = Column(String(255), nullable=False)
+    # legacy JSON copy of the detections, superseded by the columns below
+    result = Column(String(255), nullable=True)
     date = Column(Date, nullable=False)
+    cardboard_q = Column(Integer, nullable=False, default=0)
+    cardboard_w = Column(Integer, nullable=False, default=0)
+    paper_q = Column(Integer, nullable=False, default=0)
+    paper_w = Column(Integer, nullable=False, default=0)
+    plastic_q = Column(Integer, nullable=False, default=0)
+    plastic_w = Column(Integer, nullable=False, default=0)
+    glass_q = Column(Integer, nullable=False, default=0)
+    glass_w = Column(Integer, nullable=False, default=0)
+    metal_q = Column(Integer, nullable=False, default=0)
+    metal_w = Column(Integer, nullable=False, default=0)
+    # detection boxes relative to the image size, used to draw the overlay on
+    # request; NULL for uploads stored with the overlay already drawn on
+    boxes = Column(Text, nullable=True)
+
+    @staticmethod
+    def result_columns(result):
+        # result_dict -> column values
+        columns = {}
+        for category in CATEGORIES:
+            counts = result.get(category) or {}
+            columns[category + '_q'] = counts.get('q', 0)
+            columns[category + '_w'] = counts.get('w', 0)
+        return columns
+
+    def result_dict(self):
+        return {category: {"q": getattr(self, category + '_q'), "w": getattr(self, category + '_w')} for category in CATEGORIES}
 
 class Achievement(Base):
     __tablename__ = 'achievement'
@@ -28,3 +60,31 @@ class Achievement(Base):
     metal = Column(Integer, nullable=False)
     glass = Column(Integer, nullable=False)
     total = Column(Integer, nullable=False)
+
+class PredictionCache(Base):
+    __tablename__ = 'prediction_cache'
+
+    key = Column(String(64), primary_key=True)
+    model = Column(String(64), nullable=False, index=True)
+    name = Column(String(255), nullable=False)
+    result = Column(Text, nullable=False)
+    boxes = Column(Text, nullable=True)
+    created_at = Column(DateTime, nullable=False)
+
+class DailyRollup(Base):
+    __tablename__ = 'daily_rollup'
+
+    user_id = Column(Integer, primary_key=True)
+    date = Column(Date, primary_key=True)
+    category = Column(String(20), primary_key=True)
+    quantity = Column(Integer, nullable=False, default=0)
+    weight = Column(Integer, nullable=False, default=0)
+
+class MonthlyRollup(Base):
+    __tablename__ = 'monthly_rollup'
+
+    user_id = Column(Integer, primary_key=True)
+    month = Column(Date, primary_key=True)  # first day of the month
+    category = Column(String(20), primary_key=True)
+    quantity = Column(Integer, nullable=False, default=0)
+    weight = Column(Integer, nullable=False, default=0)
@@ -0,0 +1,125 @@
+# On-demand renders of stored uploads: the annotated overlay and resized
+# variants are drawn the first time they are requested and kept on disk
+# under RENDER_DIR, evicting the least recently used files once the
+# directory grows past RENDER_CACHE_BYTES.
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+import config
+from imaging import REDUCED_FLAGS, image_size, reduction_factor
+from inference import deserialize_detections, draw_detections
+from metrics import stage
+
+# longest side in pixels for each size variant; None keeps the stored size
+SIZES = {"thumb": 256, "medium": 1024, "full": None}
+VARIANTS = ("annotated", "raw")
+
+
+def render_name(tag, variant, size, boxes=None):
+    # tag identifies the stored file; the boxes digest keeps overlays from
+    # different models on the same content apart
+    if boxes:
+        return f"{tag}-{variant}-{size}-{hashlib.sha1(boxes.encode()).hexdigest()[:12]}.jpg"
+    return f"{tag}-{variant}-{size}.jpg"
+
+
+def render_image(source, target, boxes, max_side):
+    # runs in the worker pool; boxes is the stored detection JSON or None
+    with stage("render_read"):
+        with open(source, "rb") as f:
+            data = f.read()
+    if not data:
+        return False
+    with stage("render_decode"):
+        stored = image_size(data)
+        # small variants decode straight at 1/2, 1/4 or 1/8 of the stored size
+        factor = reduction_factor(stored, min_side=max_side) if max_side is not None else 1
+        image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), REDUCED_FLAGS.get(factor, cv2.IMREAD_COLOR))
+        if image is None:
+            return False
+        height, width = image.shape[:2]
+        if max_side is not None and max(height, width) > max_side:
+            ratio = max_side / max(height, width)
+            image = cv2.resize(image, (round(width * ratio), round(height * ratio)), interpolation=cv2.INTER_AREA)
+    if boxes:
+        with stage("draw"):
+            detections, names = deserialize_detections(boxes, image.shape)
+            original = max(stored) if stored else max(height, width)
+            draw_detections(image, detections, names, scale=max(image.shape[:2]) / original)
+    # write under a hidden name (keeping the .jpg extension cv2 needs) and
+    # rename, so readers never see a half-written render
+    tmp = os.path.join(os.path.dirname(target), f".{os.getpid()}-{threading.get_ident()}-{os.path.basename(target)}")
+    with stage("imwrite"):
+        if not cv2.imwrite(tmp, image, [cv2.IMWRITE_JPEG_QUALITY, config.RENDER_JPEG_QUALITY]):
+            return False
+    os.replace(tmp, target)
+    return True
+
+
+class RenderCache:
+    # Tracks the files in RENDER_DIR in least-recently-used order. The index
+    # is built from the directory on first use, so restarts keep the renders.
+
+    def __init__(self, directory, budget):
+        self.directory = directory
+        self.budget = budget
+        self._lock = threading.Lock()
+        self._files = None
+        self._bytes = 0
+        self._counts = {"hits": 0, "renders": 0, "evictions": 0}
+
+    def _index(self):
+        if self._files is None:
+            os.makedirs(self.directory, exist_ok=True)
+            entries = []
+            for entry in os.scandir(self.directory):
+                if entry.is_file() and entry.name.endswith(".jpg") and not entry.name.startswith("."):
+                    stat = entry.stat()
+                    entries.append((stat.st_atime, entry.name, stat.st_size))
+            self._files = OrderedDict((name, size) for _, name, size in sorted(entries))
+            self._bytes = sum(self._files.values())
+        return self._files
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def lookup(self, name):
+        with self._lock:
+            files = self._index()
+            if name not in files:
+                return None
+            if not os.path.exists(self.path(name)):
+                # removed by another worker's eviction
+                self._bytes -= files.pop(name)
+                return None
+            files.move_to_end(name)
+            self._counts["hits"] += 1
+            return self.path(name)
+
+    def add(self, name):
+        size = os.path.getsize(self.path(name))
+        with self._lock:
+            files = self._index()
+            self._bytes += size - files.pop(name, 0)
+            files[name] = size
+            self._counts["renders"] += 1
+            while self._bytes > self.budget and len(files) > 1:
+                old, old_size = files.popitem(last=False)
+                self._bytes -= old_size
+                self._counts["evictions"] += 1
+                try:
+                    os.remove(self.path(old))
+                except FileNotFoundError:
+                    pass
+        return self.path(name)
+
+    def stats(self):
+        with self._lock:
+            files = self._index()
+            return dict(self._counts, files=len(files), bytes=self._bytes, budget=self.budget)
@@ -0,0 +1,72 @@
+# Conditional and ranged file responses for immutable images.
+
+import asyncio
+import os
+
+from fastapi.responses import FileResponse, Response, StreamingResponse
+
+# content-addressed files never change, so clients may keep them for a year
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+CHUNK_SIZE = 64 * 1024
+
+
+def etag_matches(header, etag):
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # weak comparison, as RFC 9110 asks for If-None-Match
+    bare = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == bare for tag in header.split(","))
+
+
+def parse_range(header, size):
+    # single "bytes=start-end" range -> (start, end) inclusive; None when the
+    # header is absent or not something we serve partially, ValueError when
+    # it cannot be satisfied
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start, _, end = header[6:].strip().partition("-")
+    if not start:
+        if not end.isdigit() or int(end) == 0:
+            raise ValueError(header)
+        return max(size - int(end), 0), size - 1
+    if not start.isdigit() or (end and not end.isdigit()):
+        return None
+    start, end = int(start), int(end) if end else size - 1
+    if start >= size or end < start:
+        raise ValueError(header)
+    return start, min(end, size - 1)
+
+
+def _read_range(path, start, end):
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+async def file_response(request, path, etag, media_type=None, cache_control=IMMUTABLE, size=None):
+    # size saves the stat when the caller already has it
+    headers = {"ETag": etag, "Cache-Control": cache_control, "Accept-Ranges": "bytes"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    if size is None:
+        size = await asyncio.to_thread(os.path.getsize, path)
+    if_range = request.headers.get("if-range")
+    try:
+        byte_range = parse_range(request.headers.get("range"), size) if not if_range or if_range == etag else None
+    except ValueError:
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+    if byte_range is None:
+        # whole file: FileResponse lets the server use sendfile
+        return FileResponse(path, media_type=media_type, headers=headers)
+    start, end = byte_range
+    headers.update({"Content-Range": f"bytes {start}-{end}/{size}", "Content-Length": str(end - start + 1)})
+    return StreamingResponse(_read_range(path, start, end), status_code=206, media_type=media_type, headers=headers)
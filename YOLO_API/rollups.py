@@ -0,0 +1,123 @@
+# Per-user, per-day and per-month totals for each waste category, kept in
+# step with `posts` by /upload/ and /update/ so the dashboard charts read a
+# handful of rows instead of parsing every result string.
+#
+# Rebuild from existing posts with:
+#
+#   python rollups.py backfill
+
+import argparse
+from datetime import timedelta
+
+from sqlalchemy import func, select, update
+from sqlalchemy.exc import IntegrityError
+
+import models
+from models import CATEGORIES
+
+
+def month_start(day):
+    return day.replace(day=1)
+
+
+async def _increment(db, table, key, quantity, weight):
+    # SQL side increment so concurrent uploads for the same user/day add up;
+    # the first upload of the period inserts the row instead
+    filters = [getattr(table, column) == value for column, value in key.items()]
+    values = {'quantity': table.quantity + quantity, 'weight': table.weight + weight}
+    if (await db.execute(update(table).where(*filters).values(**values))).rowcount:
+        return
+    try:
+        async with db.begin_nested():
+            db.add(table(quantity=quantity, weight=weight, **key))
+    except IntegrityError:
+        # another request inserted the row first
+        await db.execute(update(table).where(*filters).values(**values))
+
+
+async def apply_result(db, user_id, day, result, sign=1):
+    # add (or with sign=-1 remove) one result_dict; the caller commits
+    for category in CATEGORIES:
+        counts = result.get(category) or {}
+        quantity = sign * counts.get('q', 0)
+        weight = sign * counts.get('w', 0)
+        if not quantity and not weight:
+            continue
+        await _increment(db, models.DailyRollup, {'user_id': user_id, 'date': day, 'category': category}, quantity, weight)
+        await _increment(db, models.MonthlyRollup, {'user_id': user_id, 'month': month_start(day), 'category': category}, quantity, weight)
+
+
+async def apply_correction(db, user_id, day, old_result, new_result):
+    await apply_result(db, user_id, day, old_result, sign=-1)
+    await apply_result(db, user_id, day, new_result)
+
+
+async def chart_rows(db, user_id, start_date, end_date, monthly=False):
+    # (date, category, quantity, weight) rows for dates inside
+    # [start_date, end_date], oldest first. Monthly charts read whole months
+    # from monthly_rollup and only the partial first month from daily_rollup.
+    first_day = (start_date - timedelta(microseconds=1)).date() + timedelta(days=1)
+    last_day = end_date.date()
+    daily = models.DailyRollup
+    if not monthly or first_day.day == 1:
+        split = first_day
+    else:
+        split = month_start(first_day.replace(day=28) + timedelta(days=4))
+    rows = []
+    if monthly:
+        monthly_table = models.MonthlyRollup
+        partial = select(daily.date, daily.category, daily.quantity, daily.weight).filter(
+            daily.user_id == user_id, daily.date >= first_day, daily.date < split, daily.date <= last_day)
+        rows.extend((await db.execute(partial.order_by(daily.date))).all())
+        full = select(monthly_table.month, monthly_table.category, monthly_table.quantity, monthly_table.weight).filter(
+            monthly_table.user_id == user_id, monthly_table.month >= split, monthly_table.month <= last_day)
+        rows.extend((await db.execute(full.order_by(monthly_table.month))).all())
+    else:
+        query = select(daily.date, daily.category, daily.quantity, daily.weight).filter(
+            daily.user_id == user_id, daily.date >= first_day, daily.date <= last_day)
+        rows.extend((await db.execute(query.order_by(daily.date))).all())
+    return rows
+
+
+def backfill(db):
+    # rebuild both rollup tables from posts in one transaction; the sums are
+    # done by the database over the numeric detection columns
+    image = models.Image
+    sums = [func.sum(getattr(image, category + suffix)) for category in CATEGORIES for suffix in ('_q', '_w')]
+    daily = {}
+    for user_id, day, *totals in db.query(image.user_id, image.date, *sums).group_by(image.user_id, image.date):
+        for i, category in enumerate(CATEGORIES):
+            quantity, weight = int(totals[2 * i] or 0), int(totals[2 * i + 1] or 0)
+            if quantity or weight:
+                daily[(user_id, day, category)] = [quantity, weight]
+    monthly = {}
+    for (user_id, day, category), (quantity, weight) in daily.items():
+        totals = monthly.setdefault((user_id, month_start(day), category), [0, 0])
+        totals[0] += quantity
+        totals[1] += weight
+    db.query(models.DailyRollup).delete(synchronize_session=False)
+    db.query(models.MonthlyRollup).delete(synchronize_session=False)
+    db.bulk_insert_mappings(models.DailyRollup, [
+        {'user_id': user_id, 'date': day, 'category': category, 'quantity': q, 'weight': w}
+        for (user_id, day, category), (q, w) in daily.items()])
+    db.bulk_insert_mappings(models.MonthlyRollup, [
+        {'user_id': user_id, 'month': month, 'category': category, 'quantity': q, 'weight': w}
+        for (user_id, month, category), (q, w) in monthly.items()])
+    db.commit()
+    return len(daily), len(monthly)
+
+
+if __name__ == "__main__":
+    from database import SessionLocal, engine
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=["backfill"])
+    args = parser.parse_args()
+
+    models.Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        days, months = backfill(db)
+        print(f"rebuilt {days} daily and {months} monthly rollup rows")
+    finally:
+        db.close()
@@ -0,0 +1,81 @@
+# Image storage. Uploads are stored once per distinct content under a key
+# made of their SHA-256 and extension; the local backend shards keys into
+# two levels of hash-prefix directories so no directory grows past a few
+# thousand entries. Other backends (object stores) implement the same
+# interface.
+
+import os
+import shutil
+
+import config
+
+
+class Storage:
+    # keys look like "<sha256><ext>"
+
+    def put(self, source, key):
+        # move the local file `source` in under `key`; a no-op (source is
+        # dropped) when the content is already stored
+        raise NotImplementedError
+
+    def exists(self, key):
+        raise NotImplementedError
+
+    def size(self, key):
+        raise NotImplementedError
+
+    def open(self, key):
+        # seekable binary file object
+        raise NotImplementedError
+
+    def local_path(self, key):
+        # path on this machine for decoders and sendfile; remote backends
+        # fetch into a local cache first
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+
+class LocalStorage(Storage):
+
+    def __init__(self, root):
+        self.root = root
+
+    def local_path(self, key):
+        return os.path.join(self.root, key[:2], key[2:4], key)
+
+    def put(self, source, key):
+        target = self.local_path(key)
+        if os.path.exists(target):
+            os.remove(source)
+            return target
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        try:
+            os.replace(source, target)
+        except OSError:
+            # source on another filesystem
+            shutil.move(source, target)
+        return target
+
+    def exists(self, key):
+        return os.path.exists(self.local_path(key))
+
+    def size(self, key):
+        return os.path.getsize(self.local_path(key))
+
+    def open(self, key):
+        return open(self.local_path(key), "rb")
+
+    def delete(self, key):
+        try:
+            os.remove(self.local_path(key))
+        except FileNotFoundError:
+            pass
+
+
+BACKENDS = {"local": LocalStorage}
+
+
+def get_storage():
+    return BACKENDS[config.STORAGE_BACKEND](config.STORAGE_ROOT)
@@ -0,0 +1,155 @@
+# Streaming upload ingestion. Upload bodies are copied to storage in fixed
+# size chunks without ever holding a whole image in memory, and oversized or
+# unsupported files are refused as soon as the offending bytes arrive.
+
+import asyncio
+import hashlib
+import os
+import uuid
+
+from fastapi import HTTPException
+from starlette.responses import JSONResponse
+
+import config
+from imaging import EXTENSIONS, image_size, sniff_type
+
+# bytes kept from the start of the file to find the type and dimensions;
+# JPEG EXIF blocks can push the frame header past the first few KB
+HEADER_BYTES = 256 * 1024
+
+
+class ReceivedUpload:
+    # an upload written to a temporary file next to its final location
+
+    def __init__(self, path, digest, size, extension):
+        self.path = path
+        self.digest = digest
+        self.size = size
+        self.extension = extension
+
+    @property
+    def key(self):
+        return f"{self.digest}{self.extension}"
+
+    async def store(self, storage):
+        # identical content is stored once; a duplicate just drops the temp file
+        await asyncio.to_thread(storage.put, self.path, self.key)
+        self.path = None
+
+    async def discard(self):
+        if self.path is not None:
+            await asyncio.to_thread(_unlink, self.path)
+            self.path = None
+
+
+def _unlink(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _check_header(head, size_known):
+    kind = sniff_type(head)
+    if kind is None:
+        raise HTTPException(status_code=415, detail="Unsupported image type")
+    if not size_known:
+        size = image_size(head)
+        if size is not None:
+            width, height = size
+            if width * height > config.MAX_UPLOAD_PIXELS:
+                raise HTTPException(status_code=413, detail="Image dimensions too large")
+            return kind, True
+    return kind, size_known
+
+
+async def receive_upload(file, directory):
+    # stream an UploadFile to `directory`, hashing it on the way through
+    path = os.path.join(directory, f".{uuid.uuid4()}.part")
+    digest = hashlib.sha256()
+    head = bytearray()
+    size = 0
+    kind = None
+    size_known = False
+    f = await asyncio.to_thread(open, path, "wb")
+    try:
+        while True:
+            chunk = await file.read(config.UPLOAD_CHUNK_BYTES)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > config.MAX_UPLOAD_BYTES:
+                raise HTTPException(status_code=413, detail="Upload too large")
+            if len(head) < HEADER_BYTES:
+                head += chunk[:HEADER_BYTES - len(head)]
+                kind, size_known = _check_header(bytes(head), size_known)
+            digest.update(chunk)
+            await asyncio.to_thread(f.write, chunk)
+        if kind is None:
+            raise HTTPException(status_code=415, detail="Unsupported image type")
+    except BaseException:
+        await asyncio.to_thread(f.close)
+        await asyncio.to_thread(_unlink, path)
+        raise
+    await asyncio.to_thread(f.close)
+    return ReceivedUpload(path, digest.hexdigest(), size, EXTENSIONS[kind])
+
+
+class UploadLimitMiddleware:
+    # Rejects upload requests whose body is bigger than the configured limit
+    # before the multipart parser spools it: straight away when Content-Length
+    # says so, otherwise as soon as the streamed body crosses the limit.
+
+    def __init__(self, app, limits):
+        # limits maps a path to its maximum body size in bytes
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get(scope.get("path")) if scope["type"] == "http" else None
+        if limit is None:
+            return await self.app(scope, receive, send)
+
+        for name, value in scope["headers"]:
+            if name == b"content-length" and value.isdigit() and int(value) > limit:
+                return await self._reject(scope, receive, send)
+
+        received = 0
+        started = False
+        cut = False
+
+        async def limited_receive():
+            # Raising here would be caught by the form parser and turned into
+            # a 400, so the 413 is sent from here and the app is told the
+            # client went away; whatever it answers is dropped below.
+            nonlocal received, cut
+            if cut:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    cut = True
+                    if not started:
+                        await self._reject(scope, receive, send)
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def tracking_send(message):
+            nonlocal started
+            if cut:
+                return
+            if message["type"] == "http.response.start":
+                started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracking_send)
+        except Exception:
+            # the app failing on the cut-off body is expected, the 413 is out
+            if not cut:
+                raise
+
+    async def _reject(self, scope, receive, send):
+        response = JSONResponse(status_code=413, content={"detail": "Upload too large"}, headers={"Connection": "close"})
+        await response(scope, receive, send)
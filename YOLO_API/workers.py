@@ -0,0 +1,58 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+
+
+class PoolSaturated(Exception):
+    def __init__(self, retry_after):
+        super().__init__("worker pool saturated")
+        self.retry_after = retry_after
+
+
+class WorkerPool:
+    # Runs CPU heavy work (inference, OpenCV) off the event loop. Callers take a
+    # slot before queueing work; once max_pending slots are taken new work is
+    # refused straight away instead of piling up behind the busy workers.
+
+    def __init__(self, kind="thread", max_workers=None, max_pending=32, retry_after=1, initializer=None, initargs=()):
+        self.kind = kind
+        self.max_workers = max_workers or multiprocessing.cpu_count()
+        self.max_pending = max_pending
+        self.retry_after = retry_after
+        if kind == "process":
+            # spawn so workers do not inherit torch threads from the parent
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn"), initializer=initializer, initargs=initargs)
+        elif kind == "thread":
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="worker")
+        else:
+            raise ValueError(f"unknown worker pool kind: {kind}")
+        self._pending = 0
+
+    def acquire(self, count=1):
+        # only touched from the event loop thread, so a plain counter is enough
+        count = min(count, self.max_pending)
+        if self._pending + count > self.max_pending:
+            raise PoolSaturated(self.retry_after)
+        self._pending += count
+        return count
+
+    def release(self, count=1):
+        self._pending -= count
+
+    @contextmanager
+    def slot(self, count=1):
+        count = self.acquire(count)
+        try:
+            yield
+        finally:
+            self.release(count)
+
+    async def run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        return {"kind": self.kind, "workers": self.max_workers, "pending": self._pending, "max_pending": self.max_pending}